@@ -37,6 +37,9 @@ author:
 notes:
     - Requires fortiosapi library developed by Fortinet
     - Run as a local_action in your playbook
+    - Supports check mode, which only reads the FortiGate and returns the
+      differences as diff. Without the httpapi connection, check mode
+      uses the REST API directly instead of fortiosapi.
 requirements:
     - fortiosapi>=0.9.8
 options:
@@ -57,6 +60,10 @@ options:
             - Virtual domain, among those defined previously. A vdom is a
               virtual instance of the FortiGate that can be configured and
               used as a different unit.
+            - A list of vdoms, or C(all) for every vdom of the FortiGate,
+              applies the same change to each of them and returns the
+              responses by vdom.
+        type: raw
         default: root
     https:
         description:
@@ -64,12 +71,36 @@ options:
               protocol
         type: bool
         default: true
+    reuse_session:
+        description:
+            - Keep the login to the FortiGate between tasks instead of logging
+              in and out on each of them. The session cookies are kept in a
+              file only readable by the current user and the FortiGate is only
+              logged in again when the session has expired. Only used without
+              the httpapi connection.
+            - Requests of one task share a keep-alive connection, but each task
+              still opens its own connection. Use the httpapi connection to also
+              keep connections and TLS sessions between tasks.
+        type: bool
+        default: false
+    transaction:
+        description:
+            - Apply all the changes of the task in a single CMDB transaction,
+              committed when every change succeeded and aborted otherwise.
+              Requires the httpapi connection and a FortiOS version with REST
+              API transaction support.
+        type: bool
+        default: false
     state:
         description:
             - Indicates whether to create or remove the object
+            - C(overridden) makes the table hold exactly the devices of
+              I(objects), deleting the other ones. Only the devices that
+              differ from the FortiGate are written.
         choices:
             - present
             - absent
+            - overridden
     user_device:
         description:
             - Configure devices.
@@ -149,6 +180,89 @@ options:
             user:
                 description:
                     - User name.
+    objects:
+        description:
+            - List of devices to configure in a single task, sharing the
+              same state and vdom. Each item takes the same options as
+              I(user_device) and gets its own response in the result.
+              Mutually exclusive with I(user_device).
+        default: null
+        type: list
+        suboptions:
+            alias:
+                description:
+                    - Device alias.
+                required: true
+            avatar:
+                description:
+                    - Image file for avatar (maximum 4K base64 encoded).
+            category:
+                description:
+                    - Device category.
+                choices:
+                    - none
+                    - amazon-device
+                    - android-device
+                    - blackberry-device
+                    - fortinet-device
+                    - ios-device
+                    - windows-device
+            comment:
+                description:
+                    - Comment.
+            mac:
+                description:
+                    - Device MAC address(es).
+            master_device:
+                description:
+                    - Master device (optional). Source user.device.alias.
+            tagging:
+                description:
+                    - Config object tagging.
+                suboptions:
+                    category:
+                        description:
+                            - Tag category. Source system.object-tagging.category.
+                    name:
+                        description:
+                            - Tagging entry name.
+                        required: true
+                    tags:
+                        description:
+                            - Tags.
+                        suboptions:
+                            name:
+                                description:
+                                    - Tag name. Source system.object-tagging.tags.name.
+                                required: true
+            type:
+                description:
+                    - Device type.
+                choices:
+                    - unknown
+                    - android-phone
+                    - android-tablet
+                    - blackberry-phone
+                    - blackberry-playbook
+                    - forticam
+                    - fortifone
+                    - fortinet-device
+                    - gaming-console
+                    - ip-phone
+                    - ipad
+                    - iphone
+                    - linux-pc
+                    - mac
+                    - media-streaming
+                    - printer
+                    - router-nat-device
+                    - windows-pc
+                    - windows-phone
+                    - windows-tablet
+                    - other-network-device
+            user:
+                description:
+                    - User name.
 '''
 
 EXAMPLES = '''
@@ -183,6 +297,27 @@ EXAMPLES = '''
                 name: "default_name_13 (source system.object-tagging.tags.name)"
         type: "unknown"
         user: "<your_own_value>"
+
+  - name: Configure many devices in one task.
+    fortios_user_device:
+      host:  "{{ host }}"
+      username: "{{ username }}"
+      password: "{{ password }}"
+      vdom:  "{{ vdom }}"
+      state: "present"
+      objects:
+        - alias: "<your_own_value>"
+          mac: "<your_own_value>"
+        - alias: "<your_own_value>"
+          mac: "<your_own_value>"
+
+  - name: Keep only these devices.
+    fortios_user_device:
+      vdom:  "{{ vdom }}"
+      state: "overridden"
+      objects:
+        - alias: "<your_own_value>"
+          mac: "<your_own_value>"
 '''
 
 RETURN = '''
@@ -244,161 +379,58 @@ version:
 
 '''
 
-from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.connection import Connection
-from ansible.module_utils.network.fortios.fortios import FortiOSHandler
-from ansible.module_utils.network.fortimanager.common import FAIL_SOCKET_MSG
-
-
-def login(data, fos):
-    host = data['host']
-    username = data['username']
-    password = data['password']
-
-    fos.debug('on')
-    if 'https' in data and not data['https']:
-        fos.https('off')
-    else:
-        fos.https('on')
-
-    fos.login(host, username, password)
-
-
-def filter_user_device_data(json):
-    option_list = ['alias', 'avatar', 'category',
-                   'comment', 'mac', 'master_device',
-                   'tagging', 'type', 'user']
-    dictionary = {}
-
-    for attribute in option_list:
-        if attribute in json and json[attribute] is not None:
-            dictionary[attribute] = json[attribute]
-
-    return dictionary
-
-
-def underscore_to_hyphen(data):
-    if isinstance(data, list):
-        for elem in data:
-            elem = underscore_to_hyphen(elem)
-    elif isinstance(data, dict):
-        new_data = {}
-        for k, v in data.items():
-            new_data[k.replace('_', '-')] = underscore_to_hyphen(v)
-        data = new_data
-
-    return data
-
-
-def user_device(data, fos):
-    vdom = data['vdom']
-    state = data['state']
-    user_device_data = data['user_device']
-    filtered_data = underscore_to_hyphen(filter_user_device_data(user_device_data))
-
-    if state == "present":
-        return fos.set('user',
-                       'device',
-                       data=filtered_data,
-                       vdom=vdom)
-
-    elif state == "absent":
-        return fos.delete('user',
-                          'device',
-                          mkey=filtered_data['alias'],
-                          vdom=vdom)
-
-
-def is_successful_status(status):
-    return status['status'] == "success" or \
-        status['http_method'] == "DELETE" and status['http_status'] == 404
+from ansible.module_utils.network.fortios.runtime import fortios_configure, fortios_configure_in_transaction, load_options, run_module
+
+USER_DEVICE_SPEC = {
+    "path": "user",
+    "name": "device",
+    "option": "user_device",
+    "mkey": "alias",
+    "options": load_options('''
+{
+    "alias": {"required": true, "type": "str"},
+    "avatar": {"type": "str"},
+    "category": {"type": "str",
+                 "choices": ["none", "amazon-device", "android-device",
+                             "blackberry-device", "fortinet-device", "ios-device",
+                             "windows-device"]},
+    "comment": {"type": "str"},
+    "mac": {"type": "str"},
+    "master_device": {"type": "str"},
+    "tagging": {"type": "list",
+                "options": {
+                    "category": {"type": "str"},
+                    "name": {"required": true, "type": "str"},
+                    "tags": {"type": "list",
+                             "options": {
+                                 "name": {"required": true, "type": "str"}
+                             }}
+                }},
+    "type": {"type": "str",
+             "choices": ["unknown", "android-phone", "android-tablet",
+                         "blackberry-phone", "blackberry-playbook", "forticam",
+                         "fortifone", "fortinet-device", "gaming-console",
+                         "ip-phone", "ipad", "iphone",
+                         "linux-pc", "mac", "media-streaming",
+                         "printer", "router-nat-device", "windows-pc",
+                         "windows-phone", "windows-tablet", "other-network-device"]},
+    "user": {"type": "str"}
+}
+''')
+}
 
 
 def fortios_user(data, fos):
+    return fortios_configure(USER_DEVICE_SPEC, data, fos)
 
-    if data['user_device']:
-        resp = user_device(data, fos)
 
-    return not is_successful_status(resp), \
-        resp['status'] == "success", \
-        resp
+def fortios_user_in_transaction(data, fos):
+    return fortios_configure_in_transaction(USER_DEVICE_SPEC, data, fos)
 
 
 def main():
-    fields = {
-        "host": {"required": False, "type": "str"},
-        "username": {"required": False, "type": "str"},
-        "password": {"required": False, "type": "str", "no_log": True},
-        "vdom": {"required": False, "type": "str", "default": "root"},
-        "https": {"required": False, "type": "bool", "default": True},
-        "state": {"required": True, "type": "str",
-                  "choices": ["present", "absent"]},
-        "user_device": {
-            "required": False, "type": "dict",
-            "options": {
-                "alias": {"required": True, "type": "str"},
-                "avatar": {"required": False, "type": "str"},
-                "category": {"required": False, "type": "str",
-                             "choices": ["none", "amazon-device", "android-device",
-                                         "blackberry-device", "fortinet-device", "ios-device",
-                                         "windows-device"]},
-                "comment": {"required": False, "type": "str"},
-                "mac": {"required": False, "type": "str"},
-                "master_device": {"required": False, "type": "str"},
-                "tagging": {"required": False, "type": "list",
-                            "options": {
-                                "category": {"required": False, "type": "str"},
-                                "name": {"required": True, "type": "str"},
-                                "tags": {"required": False, "type": "list",
-                                         "options": {
-                                             "name": {"required": True, "type": "str"}
-                                         }}
-                            }},
-                "type": {"required": False, "type": "str",
-                         "choices": ["unknown", "android-phone", "android-tablet",
-                                     "blackberry-phone", "blackberry-playbook", "forticam",
-                                     "fortifone", "fortinet-device", "gaming-console",
-                                     "ip-phone", "ipad", "iphone",
-                                     "linux-pc", "mac", "media-streaming",
-                                     "printer", "router-nat-device", "windows-pc",
-                                     "windows-phone", "windows-tablet", "other-network-device"]},
-                "user": {"required": False, "type": "str"}
-
-            }
-        }
-    }
-
-    module = AnsibleModule(argument_spec=fields,
-                           supports_check_mode=False)
-
-    legacy_mode = 'host' in module.params and module.params['host'] is not None and \
-                  'username' in module.params and module.params['username'] is not None and \
-                  'password' in module.params and module.params['password'] is not None
-
-    if not legacy_mode:
-        if module._socket_path:
-            connection = Connection(module._socket_path)
-            fos = FortiOSHandler(connection)
-
-            is_error, has_changed, result = fortios_user(module.params, fos)
-        else:
-            module.fail_json(**FAIL_SOCKET_MSG)
-    else:
-        try:
-            from fortiosapi import FortiOSAPI
-        except ImportError:
-            module.fail_json(msg="fortiosapi module is required")
-
-        fos = FortiOSAPI()
-
-        login(module.params, fos)
-        is_error, has_changed, result = fortios_user(module.params, fos)
-        fos.logout()
-
-    if not is_error:
-        module.exit_json(changed=has_changed, meta=result)
-    else:
-        module.fail_json(msg="Error in repo", meta=result)
+    run_module(USER_DEVICE_SPEC, Connection)
 
 
 if __name__ == '__main__':
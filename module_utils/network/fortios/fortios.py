@@ -26,12 +26,27 @@
 # LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
+import errno
+import gzip
+import hashlib
 import os
+import stat
+import tempfile
 import time
 import traceback
 
-from ansible.module_utils._text import to_native
+from bisect import bisect_left
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from ansible.module_utils._text import to_bytes, to_native, to_text
 from ansible.module_utils.basic import env_fallback
+from ansible.module_utils.network.fortios.codec import dumps, loads
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+from ansible.module_utils.urls import Request
 
 import json
 
@@ -77,16 +92,412 @@ fortios_error_codes = {
 
 # END DEPRECATED
 
+# Number of entries read per request when walking a whole CMDB table
+CMDB_PAGE_SIZE = 1000
+
+# Seconds an idle transaction is kept open by the device
+TRANSACTION_TIMEOUT = 60
+
+
+def matches_config(desired, current):
+    if isinstance(desired, dict):
+        if not isinstance(current, dict):
+            return False
+        return all(matches_config(value, current.get(key)) for key, value in desired.items() if value is not None)
+    if isinstance(desired, list):
+        # Order is kept significant, a false difference only costs a PUT
+        if not isinstance(current, list) or len(desired) != len(current):
+            return False
+        return all(matches_config(d, c) for d, c in zip(desired, current))
+    return desired == current
+
+
+def config_diff(desired, current):
+    """Attributes of desired which differ from the current config."""
+    current = current or {}
+    return dict((key, value) for key, value in desired.items()
+                if value is not None and not matches_config(value, current.get(key)))
+
+
+def plan_moves(current, desired):
+    """Fewest moves putting the objects of desired in that order.
+
+    The longest run of desired objects already in the right order relative to
+    each other stays in place, every other object is moved right after the one
+    it must follow. Objects which are not in desired are left where they are.
+    Returns (mkey, where, reference_key) tuples, to apply in order.
+    """
+    rank = dict((mkey, index) for index, mkey in enumerate(desired))
+    ranks = [rank[mkey] for mkey in current if mkey in rank]
+
+    # Longest increasing subsequence of the ranks, in O(n log n)
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(ranks)
+    for index, value in enumerate(ranks):
+        position = bisect_left(tails, value)
+        if position == len(tails):
+            tails.append(value)
+            tail_indexes.append(index)
+        else:
+            tails[position] = value
+            tail_indexes[position] = index
+        previous[index] = tail_indexes[position - 1] if position else None
+    kept = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        kept.add(desired[ranks[index]])
+        index = previous[index]
+
+    moves = []
+    for index, mkey in enumerate(desired):
+        if mkey in kept:
+            continue
+        if index:
+            moves.append((mkey, 'after', desired[index - 1]))
+        else:
+            # The first object goes before the first one staying in place
+            moves.append((mkey, 'before', [item for item in desired if item in kept][0]))
+    return moves
+
+
+class SchemaCache(object):
+    """Bounded LRU cache of CMDB table schemas.
+
+    Entries are keyed by (path, name, vdom scope). A table schema is the same
+    in every vdom, so all vdoms share one entry and only global differs.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def scope(vdom=None):
+        return 'global' if vdom == 'global' else 'vdom'
+
+    def key(self, path, name, vdom=None):
+        return (path, name, self.scope(vdom))
+
+    def get(self, path, name, vdom=None):
+        key = self.key(path, name, vdom)
+        try:
+            schema = self._entries.pop(key)
+        except KeyError:
+            return None
+        self._entries[key] = schema
+        return schema
+
+    def put(self, path, name, schema, vdom=None):
+        key = self.key(path, name, vdom)
+        self._entries.pop(key, None)
+        self._entries[key] = schema
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, path=None, name=None, vdom=None):
+        if path is None and name is None and vdom is None:
+            self._entries.clear()
+            return
+        for key in list(self._entries):
+            if (path is None or key[0] == path) and \
+                    (name is None or key[1] == name) and \
+                    (vdom is None or key[2] == self.scope(vdom)):
+                del self._entries[key]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SchemaStore(object):
+    """CMDB table schemas of one firmware build kept on disk.
+
+    Schemas are stored in a gzip compressed JSON bundle named after the
+    FortiOS version and build, so a bundle filled by one run (or shipped
+    with the playbooks) lets the next runs resolve mkeys without asking
+    the device. Failures to write it are only logged, the schemas are still
+    served from memory.
+    """
+
+    def __init__(self, directory, version, build, log=None):
+        self.version = version
+        self.build = build
+        self.filename = os.path.join(directory, 'fortios_%s_build%s.json.gz' % (version, build))
+        self._schemas = None
+        self._log = log
+
+    @staticmethod
+    def key(path, name, vdom=None):
+        return '%s/%s/%s' % (path, name, SchemaCache.scope(vdom))
+
+    def _read(self):
+        try:
+            with gzip.open(self.filename, 'rb') as f:
+                return loads(f.read())['schemas']
+        except (IOError, OSError, ValueError, KeyError):
+            return {}
+
+    def get(self, path, name, vdom=None):
+        if self._schemas is None:
+            self._schemas = self._read()
+        return self._schemas.get(self.key(path, name, vdom))
+
+    def put(self, path, name, schema, vdom=None):
+        if self._schemas is None:
+            self._schemas = self._read()
+        self._schemas[self.key(path, name, vdom)] = schema
+        try:
+            self.save()
+        except (IOError, OSError) as e:
+            if self._log:
+                self._log('Could not save the schema store %s: %s' % (self.filename, to_native(e)))
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.filename))
+        except OSError as e:
+            # Connections to other devices may share the directory and create it first
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Other connections may have added schemas of the same build meanwhile
+        schemas = self._read()
+        schemas.update(self._schemas or {})
+        self._schemas = schemas
+
+        bundle = {'version': self.version, 'build': self.build, 'schemas': schemas}
+        tmp_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+        with gzip.open(tmp_filename, 'wb') as f:
+            f.write(to_bytes(dumps(bundle)))
+        os.rename(tmp_filename, self.filename)
+
+
+O_NOFOLLOW = getattr(os, 'O_NOFOLLOW', 0)
+
+
+def private_directory(directory):
+    """Create directory, only accessible by the current user.
+
+    Returns False when it already exists and belongs to someone else or
+    is accessible by other users, as anyone may create a directory in /tmp.
+    """
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return False
+    st = os.lstat(directory)
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+class FortiOSAPISession(object):
+    """Login of a fortiosapi FortiOSAPI object kept across module runs.
+
+    The session cookies are saved in a file only readable by the current
+    user, one per url and username, and reused by the following runs instead
+    of logging in and out on each of them. The device is only logged in
+    again when it answers 401. Sessions are neither saved nor restored when
+    the directory is not private to the current user.
+    """
+
+    def __init__(self, fos, login, host, username, https=True, directory=None):
+        self._fos = fos
+        self._login = login
+        self._relogging = False
+        self._resending = False
+        self.url_prefix = ('https://' if https else 'http://') + host
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), 'ansible-fortios-%d' % os.getuid())
+        key = hashlib.sha256(to_bytes(self.url_prefix + '\n' + username)).hexdigest()
+        self.filename = os.path.join(directory, 'session-%s.json' % key)
+
+    def open(self):
+        if not self._restore():
+            self._relogin()
+        self._fos._session.hooks['response'].append(self._on_response)
+
+    def close(self):
+        # The device may have refreshed the cookies meanwhile
+        self._save()
+
+    def _restore(self):
+        if not private_directory(os.path.dirname(self.filename)):
+            return False
+        try:
+            with os.fdopen(os.open(self.filename, os.O_RDONLY | O_NOFOLLOW)) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if state.get('url_prefix') != self.url_prefix:
+            return False
+
+        fos = self._fos
+        for cookie in state['cookies']:
+            fos._session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
+        fos.update_cookie()
+        fos.host = state['host']
+        fos.url_prefix = self.url_prefix
+        fos.timeout = state['timeout']
+        fos._logged = True
+        return True
+
+    def _save(self):
+        fos = self._fos
+        state = {
+            'url_prefix': self.url_prefix,
+            'host': fos.host,
+            'timeout': fos.timeout,
+            'cookies': [dict(name=cookie.name, value=cookie.value, domain=cookie.domain, path=cookie.path)
+                        for cookie in fos._session.cookies],
+        }
+        if not private_directory(os.path.dirname(self.filename)):
+            return
+        tmp_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            # Left behind by an earlier process of the same pid
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+        with os.fdopen(os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL | O_NOFOLLOW, 0o600), 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp_filename, self.filename)
+
+    def _relogin(self):
+        self._relogging = True
+        try:
+            self._fos._session.cookies.clear()
+            self._login()
+        finally:
+            self._relogging = False
+        self._save()
+
+    def _on_response(self, res, *args, **kwargs):
+        # The resent request runs this hook too, a second 401 goes to the caller
+        if res.status_code != 401 or self._relogging or self._resending:
+            return res
+
+        self._relogin()
+        request = res.request.copy()
+        request.headers.pop('Cookie', None)
+        request.prepare_cookies(self._fos._session.cookies)
+        request.headers['X-CSRFTOKEN'] = self._fos._session.headers['X-CSRFTOKEN']
+        self._resending = True
+        try:
+            return self._fos._session.send(request, **kwargs)
+        finally:
+            self._resending = False
+
+
+class FortiOSDirectConnection(object):
+    """Connection to a FortiGate opened by the module process itself.
+
+    It answers the same send_request(), send_requests() and schema cache calls
+    as the httpapi connection, so that a single process can drive one
+    FortiOSHandler per device.
+    """
+
+    def __init__(self, host, username=None, password=None, access_token=None,
+                 https=True, ssl_verify=True, timeout=60, max_in_flight=1):
+        self.host = host
+        self.base_url = '%s://%s' % ('https' if https else 'http', host)
+        self._username = username
+        self._password = password
+        self._access_token = access_token
+        self._request = Request(headers={}, validate_certs=ssl_verify, timeout=timeout)
+        self._schema_cache = SchemaCache()
+        self.max_in_flight = max_in_flight
+
+    def login(self):
+        if self._access_token:
+            self._request.headers['Authorization'] = 'Bearer ' + self._access_token
+            return
+
+        data = urlencode({'username': self._username, 'secretkey': self._password or '', 'ajax': 1})
+        status, result_data = self.send_request(url='/logincheck', data=data, method='POST',
+                                                headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        if status != 200 or not result_data.startswith('1'):
+            raise Exception('Wrong credentials. Please check')
+
+        for cookie in self._request.cookies:
+            if cookie.name.startswith('ccsrftoken'):
+                self._request.headers['X-CSRFTOKEN'] = cookie.value.strip('"')
+
+    def logout(self):
+        if not self._access_token:
+            self.send_request(url='/logout', method='POST')
+
+    def send_request(self, url='/', params=None, data=None, method='GET', headers=None):
+        if params:
+            url += ('&' if '?' in url else '?') + urlencode(params)
+        request_headers = {'Content-Type': 'application/json'}
+        request_headers.update(headers or {})
+
+        try:
+            response = self._request.open(method, self.base_url + url, data=data, headers=request_headers)
+            status = response.getcode()
+        except HTTPError as err:
+            # Error answers carry the FortiOS status document as well
+            response = err
+            status = err.code
+        return status, to_text(response.read())
+
+    def send_requests(self, requests):
+        if self.max_in_flight <= 1 or len(requests) <= 1:
+            return [self.send_request(**request) for request in requests]
+        pool = ThreadPool(min(self.max_in_flight, len(requests)))
+        try:
+            return pool.map(lambda request: self.send_request(**request), requests)
+        finally:
+            pool.close()
+
+    def get_cached_schema(self, path, name, vdom=None):
+        return self._schema_cache.get(path, name, vdom)
+
+    def cache_schema(self, path, name, schema, vdom=None):
+        self._schema_cache.put(path, name, schema, vdom=vdom)
+
+    def invalidate_schema_cache(self, path=None, name=None, vdom=None):
+        self._schema_cache.invalidate(path, name, vdom)
+
 
 class FortiOSHandler(object):
 
-    def __init__(self, conn):
+    def __init__(self, conn, check_mode=False):
         self._conn = conn
+        self._schema_cache = SchemaCache()
+        self._tables = {}
+        self._transaction_id = None
+        self._transaction_failed = False
+        self.check_mode = check_mode
+
+    def _check_read_only(self, requests):
+        for request in requests:
+            if self.check_mode and request.get('method', 'GET') != 'GET':
+                raise Exception('%s %s would change the device in check mode' % (request['method'], request['url']))
+
+    def _send(self, **kwargs):
+        self._check_read_only([kwargs])
+        if self._transaction_id is not None:
+            kwargs['headers'] = {'X-TRANSACTION-ID': str(self._transaction_id)}
+        return self._conn.send_request(**kwargs)
+
+    def _send_many(self, requests):
+        # The connection sends them concurrently and answers in order
+        if not requests:
+            return []
+        self._check_read_only(requests)
+        if self._transaction_id is not None:
+            headers = {'X-TRANSACTION-ID': str(self._transaction_id)}
+            requests = [dict(request, headers=headers) for request in requests]
+        return self._conn.send_requests(requests)
 
     def cmdb_url(self, path, name, vdom=None, mkey=None):
 
         url = '/api/v2/cmdb/' + path + '/' + name
-        if mkey:
+        if mkey is not None:
             url = url + '/' + str(mkey)
         if vdom:
             if vdom == "global":
@@ -96,6 +507,17 @@ class FortiOSHandler(object):
         return url
 
     def schema(self, path, name, vdom=None):
+        # Look in this handler first, then in the cache kept by the
+        # persistent connection, and only then ask the device.
+        schema = self._schema_cache.get(path, name, vdom)
+        if schema is not None:
+            return schema
+
+        schema = self._conn.get_cached_schema(path, name, vdom=vdom)
+        if schema is not None:
+            self._schema_cache.put(path, name, schema, vdom=vdom)
+            return schema
+
         if vdom is None:
             url = self.cmdb_url(path, name) + "?action=schema"
         else:
@@ -105,11 +527,18 @@ class FortiOSHandler(object):
 
         if status == 200:
             if vdom == "global":
-                return json.loads(result_data.decode('utf-8'))[0]['results']
+                schema = loads(result_data)[0]['results']
             else:
-                return json.loads(result_data.decode('utf-8'))['results']
+                schema = loads(result_data)['results']
+            self._schema_cache.put(path, name, schema, vdom=vdom)
+            self._conn.cache_schema(path, name, schema, vdom=vdom)
+            return schema
         else:
-            return json.loads(result_data.decode('utf-8'))
+            return loads(result_data)
+
+    def invalidate_schema(self, path=None, name=None, vdom=None):
+        self._schema_cache.invalidate(path, name, vdom)
+        self._conn.invalidate_schema_cache(path=path, name=name, vdom=vdom)
 
     def get_mkeyname(self, path, name, vdom=None):
         schema = self.schema(path, name, vdom=vdom)
@@ -131,45 +560,434 @@ class FortiOSHandler(object):
                 return None
         return mkey
 
-    def set(self, path, name, data, mkey=None, vdom=None, parameters=None):
+    def _get_request(self, path, name, vdom=None, mkey=None, parameters=None, fields=None):
+        if fields:
+            # Let the device only send the attributes the caller looks at
+            parameters = dict(parameters or {}, format='|'.join(fields))
+        return dict(url=self.cmdb_url(path, name, vdom, mkey), params=parameters, method='GET')
+
+    def get(self, path, name, vdom=None, mkey=None, parameters=None, fields=None):
+        status, result_data = self._send(**self._get_request(path, name, vdom, mkey, parameters, fields))
+        return self.formatresponse(result_data, vdom=vdom)
+
+    def _get_current_from_table(self, path, name, vdom, mkey, fields):
+        table = self._tables.get((path, name, vdom))
+        if table is not None and mkey is not None:
+            current = table['entries'].get(str(mkey))
+            # Any listing of the table tells which objects exist, whatever attributes it holds
+            if current is None or self._table_covers(table, fields):
+                resp = dict(table['meta'], http_status=200 if current is not None else 404)
+                return resp, current
+        return None
+
+    @staticmethod
+    def _current_object(resp):
+        if resp['status'] != 'success':
+            return resp, None
+        results = resp.pop('results')
+        if isinstance(results, list):
+            results = results[0] if results else None
+        return resp, results
+
+    def get_current(self, path, name, vdom=None, mkey=None, fields=None):
+        answer = self._get_current_from_table(path, name, vdom, mkey, fields)
+        if answer is not None:
+            return answer
+        return self._current_object(self.get(path, name, vdom=vdom, mkey=mkey, fields=fields))
 
-        if not mkey:
+    def get_current_many(self, path, name, keys, fields=None):
+        # keys holds (vdom, mkey) pairs, the reads the table snapshots cannot answer are sent together
+        answers = [self._get_current_from_table(path, name, vdom, mkey, fields) for vdom, mkey in keys]
+        missing = [index for index, answer in enumerate(answers) if answer is None]
+        requests = [self._get_request(path, name, keys[index][0], keys[index][1], fields=fields) for index in missing]
+        for index, (status, result_data) in zip(missing, self._send_many(requests)):
+            answers[index] = self._current_object(self.formatresponse(result_data, vdom=keys[index][0]))
+        return answers
+
+    @staticmethod
+    def _table_covers(table, fields):
+        if table['fields'] is None:
+            return True
+        return fields is not None and set(fields) <= table['fields']
+
+    def get_pages(self, path, name, vdom=None, page_size=CMDB_PAGE_SIZE, parameters=None, fields=None):
+        start = 0
+        while True:
+            page_parameters = dict(parameters or {}, start=start, count=page_size)
+            resp = self.get(path, name, vdom=vdom, parameters=page_parameters, fields=fields)
+            last_page = resp['status'] != 'success' or len(resp['results']) < page_size
+            yield resp
+            if last_page:
+                return
+            start += page_size
+
+    def get_table(self, path, name, vdom=None, fields=None):
+        key = (path, name, vdom)
+        table = self._tables.get(key)
+        if table is None or not self._table_covers(table, fields):
+            mkeyname = self.get_mkeyname(path, name, vdom)
+            if not mkeyname:
+                return None
+            if fields:
+                fields = sorted(set(fields) | set([mkeyname]))
+            entries = {}
+            for resp in self.get_pages(path, name, vdom=vdom, fields=fields):
+                if resp['status'] != 'success':
+                    return None
+                for entry in resp.pop('results'):
+                    entries[str(entry[mkeyname])] = entry
+            table = {'meta': resp, 'entries': entries, 'fields': set(fields) if fields else None}
+            self._tables[key] = table
+        return table['entries']
+
+    def get_table_names(self, vdom=None):
+        url = '/api/v2/cmdb/?action=schema'
+        if vdom is not None and vdom != 'global':
+            url += '&vdom=' + vdom
+        status, result_data = self._send(url=url, method='GET')
+        resp = self.formatresponse(result_data)
+        if resp['status'] != 'success':
+            return None
+        return [(entry['path'], entry['name']) for entry in resp['results'] if '__tree__' not in entry['path']]
+
+    def get_tables(self, tables, vdom=None, page_size=CMDB_PAGE_SIZE, parameters=None):
+        """Read several tables whole, the pages of all of them requested together.
+
+        Returns a dictionary of the last response of each (path, name) table, its
+        results holding the entries of every page.
+        """
+        responses = OrderedDict()
+        pending = list(tables)
+        start = 0
+        while pending:
+            page_parameters = dict(parameters or {}, start=start, count=page_size)
+            requests = [dict(url=self.cmdb_url(path, name, vdom), params=page_parameters, method='GET')
+                        for path, name in pending]
+            next_pending = []
+            for table, (status, result_data) in zip(pending, self._send_many(requests)):
+                resp = self.formatresponse(result_data, vdom=vdom)
+                results = resp.get('results')
+                if table in responses and resp['status'] == 'success':
+                    results = responses[table]['results'] + results
+                    resp['results'] = results
+                responses[table] = resp
+                # Singleton tables answer with a dictionary
+                if resp['status'] == 'success' and isinstance(results, list) and len(results) == start + page_size:
+                    next_pending.append(table)
+            pending = next_pending
+            start += page_size
+        return responses
+
+    def get_order(self, path, name, vdom=None):
+        # Master keys in the order of the table, which is what policy tables are evaluated in
+        mkeyname = self.get_mkeyname(path, name, vdom)
+        if not mkeyname:
+            return None
+        order = []
+        for resp in self.get_pages(path, name, vdom=vdom, fields=[mkeyname]):
+            if resp['status'] != 'success':
+                return None
+            order.extend(str(entry[mkeyname]) for entry in resp['results'])
+        return order
+
+    def _update_table(self, path, name, vdom, mkey, data=None):
+        table = self._tables.get((path, name, vdom))
+        if table is None or mkey is None:
+            return
+        if data is None:
+            table['entries'].pop(str(mkey), None)
+        else:
+            entry = dict(table['entries'].get(str(mkey), {}))
+            entry.update(data)
+            table['entries'][str(mkey)] = entry
+
+    def _set_request(self, path, name, data, mkey=None, vdom=None, parameters=None, read=None):
+        # read is the (resp, current) answer of get_current() when the caller already has it
+        if mkey is None:
             mkey = self.get_mkey(path, name, data, vdom=vdom)
+
+        if mkey is None and self.get_mkeyname(path, name, vdom):
+            # Without its key the object cannot be read, only created with a key the device assigns
+            if self.check_mode:
+                return mkey, None, self._check_mode_response('POST', path, name, vdom, mkey, {}, config_diff(data, None))
+            return mkey, self._post_request(path, name, data, vdom, parameters=parameters), None
+
+        # Only write when the device config differs from the requested one
+        if read is None:
+            fields = sorted(key for key, value in data.items() if value is not None)
+            read = self.get_current(path, name, vdom=vdom, mkey=mkey, fields=fields)
+        resp, current = read
+        if current is not None and not config_diff(data, current):
+            resp['mkey'] = mkey
+            resp['revision_changed'] = False
+            return mkey, None, resp
+        if self.check_mode:
+            return mkey, None, self._check_mode_set(path, name, data, mkey, vdom, resp, current)
+        if current is None and resp['http_status'] != 404:
+            # Without knowing whether the object exists there is no telling PUT from POST
+            self._transaction_failed = True
+            return mkey, None, resp
+        if mkey is not None and current is None:
+            return mkey, self._post_request(path, name, data, vdom, mkey), None
+
         url = self.cmdb_url(path, name, vdom, mkey)
+        return mkey, dict(url=url, params=parameters, data=dumps(data), method='PUT'), None
 
-        status, result_data = self._conn.send_request(url=url, params=parameters, data=json.dumps(data), method='PUT')
+    def _check_mode_response(self, method, path, name, vdom, mkey, before, after):
+        # What the device would answer to the write, which is not sent
+        self._update_table(path, name, vdom, mkey, None if method == 'DELETE' else after)
+        header = '%s/%s/%s (%s)' % (path, name, '' if mkey is None else mkey, vdom or 'global')
+        return {'status': 'success', 'http_method': method, 'http_status': 200, 'check_mode': True,
+                'path': path, 'name': name, 'vdom': vdom, 'mkey': mkey,
+                'diff': {'before': before, 'after': after, 'before_header': header, 'after_header': header}}
 
-        if status == 404 or status == 405 or status == 500:
-            return self.post(path, name, data, vdom, mkey)
-        else:
-            return self.formatresponse(result_data, vdom=vdom)
+    def _check_mode_set(self, path, name, data, mkey, vdom, resp, current):
+        if current is None and resp['http_status'] != 404:
+            # The object could not be read, the write would most likely fail too
+            return resp
+        changes = config_diff(data, current)
+        if current is None:
+            return self._check_mode_response('POST' if mkey is not None else 'PUT', path, name, vdom, mkey, {}, changes)
+        before = dict((key, current.get(key)) for key in changes)
+        return self._check_mode_response('PUT', path, name, vdom, mkey, before, changes)
 
-    def post(self, path, name, data, vdom=None,
-             mkey=None, parameters=None):
+    def _check_mode_delete(self, path, name, vdom, mkey):
+        mkeyname = self.get_mkeyname(path, name, vdom)
+        resp, current = self.get_current(path, name, vdom=vdom, mkey=mkey, fields=[mkeyname] if mkeyname else None)
+        if current is None:
+            if resp['http_status'] == 404:
+                return dict(resp, status='error', http_method='DELETE', mkey=mkey, check_mode=True)
+            return resp
+        return self._check_mode_response('DELETE', path, name, vdom, mkey, current, {})
 
-        if mkey:
+    def _post_request(self, path, name, data, vdom=None, mkey=None, parameters=None):
+        if mkey is not None:
             mkeyname = self.get_mkeyname(path, name, vdom)
+            data = dict(data)
             data[mkeyname] = mkey
 
         url = self.cmdb_url(path, name, vdom, mkey=None)
+        return dict(url=url, params=parameters, data=dumps(data), method='POST')
 
-        status, result_data = self._conn.send_request(url=url, params=parameters, data=json.dumps(data), method='POST')
+    def _write_response(self, path, name, data, mkey, vdom, request, status, result_data):
+        method = request['method']
+        resp = self.formatresponse(result_data, vdom=vdom)
+        if resp['status'] == 'success':
+            if method == 'DELETE':
+                self._update_table(path, name, vdom, mkey)
+            else:
+                self._update_table(path, name, vdom, resp.get('mkey', mkey), data)
+        elif not (method == 'DELETE' and resp['http_status'] == 404):
+            # A failed write turns the end of an open transaction into an abort
+            self._transaction_failed = True
+        return resp
 
-        return self.formatresponse(result_data, vdom=vdom)
+    def set(self, path, name, data, mkey=None, vdom=None, parameters=None):
+        mkey, request, resp = self._set_request(path, name, data, mkey=mkey, vdom=vdom, parameters=parameters)
+        if request is None:
+            return resp
+
+        status, result_data = self._send(**request)
+        return self._write_response(path, name, data, mkey, vdom, request, status, result_data)
+
+    def post(self, path, name, data, vdom=None,
+             mkey=None, parameters=None):
+        if self.check_mode:
+            return self._check_mode_response('POST', path, name, vdom, mkey, {}, data)
+        request = self._post_request(path, name, data, vdom, mkey, parameters)
+        status, result_data = self._send(**request)
+        return self._write_response(path, name, data, mkey, vdom, request, status, result_data)
+
+    def _send_planned(self, path, name, planned):
+        # planned holds (data, vdom, mkey, request, resp), request is None when nothing has to be sent
+        results = iter(self._send_many([request for data, vdom, mkey, request, resp in planned if request is not None]))
+
+        responses = []
+        for data, vdom, mkey, request, resp in planned:
+            if request is not None:
+                status, result_data = next(results)
+                resp = self._write_response(path, name, data, mkey, vdom, request, status, result_data)
+            responses.append(resp)
+        return responses
+
+    def set_many(self, path, name, objects, vdom=None, parameters=None):
+        # One read of the whole table instead of one per object
+        fields = set()
+        for data in objects:
+            fields.update(key for key, value in data.items() if value is not None)
+        self.get_table(path, name, vdom=vdom, fields=fields)
+
+        planned = [(data, vdom) + self._set_request(path, name, data, vdom=vdom, parameters=parameters)
+                   for data in objects]
+        return self._send_planned(path, name, planned)
+
+    def set_table(self, path, name, objects, vdom=None, parameters=None):
+        """Make the table hold exactly the given objects.
+
+        The table is read once and only the difference is written: objects to
+        create first, so that updates may refer to them, then objects to update,
+        then objects to delete, which updates no longer refer to. Each step is
+        sent as one batch. Responses of the objects come in their order,
+        followed by those of the deleted objects.
+        """
+        mkeyname = self.get_mkeyname(path, name, vdom)
+        if not mkeyname:
+            raise Exception('%s/%s holds a single object, it has no objects to override' % (path, name))
+        fields = set([mkeyname])
+        for data in objects:
+            fields.update(key for key, value in data.items() if value is not None)
+        entries = self.get_table(path, name, vdom=vdom, fields=fields)
+        if entries is None:
+            # Give the caller the answer the table could not be read with
+            return [self.get(path, name, vdom=vdom, fields=[mkeyname])]
+        existing = list(entries)
+
+        planned = [(data, vdom) + self._set_request(path, name, data, vdom=vdom, parameters=parameters)
+                   for data in objects]
+        responses = [resp for data, vdom, mkey, request, resp in planned]
+        for creating in (True, False):
+            indexes = [index for index, (data, vdom, mkey, request, resp) in enumerate(planned)
+                       if request is not None and (request['method'] == 'POST') == creating]
+            for index, resp in zip(indexes, self._send_planned(path, name, [planned[index] for index in indexes])):
+                responses[index] = resp
+
+        desired = set(str(mkey) for data, vdom, mkey, request, resp in planned)
+        stale = [mkey for mkey in existing if mkey not in desired]
+        return responses + self.delete_many(path, name, stale, vdom=vdom, parameters=parameters)
+
+    def get_vdoms(self):
+        # The response itself when the vdoms cannot be read
+        resp = self.get('system', 'vdom', fields=['name'])
+        if resp['status'] != 'success':
+            return resp
+        return [item['name'] for item in resp['results']]
+
+    def resolve_vdoms(self, vdoms):
+        if vdoms == 'all':
+            return self.get_vdoms()
+        if isinstance(vdoms, (list, tuple)):
+            return list(vdoms)
+        return [vdoms]
+
+    def set_vdoms(self, path, name, data, vdoms, mkey=None, parameters=None):
+        # The same object written to each VDOM, the reads sent together and then the writes
+        vdoms = self.resolve_vdoms(vdoms)
+        if mkey is None and vdoms:
+            mkey = self.get_mkey(path, name, data, vdom=vdoms[0])
+        reads = [None] * len(vdoms)
+        if vdoms and (mkey is not None or not self.get_mkeyname(path, name, vdoms[0])):
+            fields = sorted(key for key, value in data.items() if value is not None)
+            reads = self.get_current_many(path, name, [(vdom, mkey) for vdom in vdoms], fields=fields)
+        planned = [(data, vdom) + self._set_request(path, name, data, mkey=mkey, vdom=vdom, parameters=parameters, read=read)
+                   for vdom, read in zip(vdoms, reads)]
+        return OrderedDict(zip(vdoms, self._send_planned(path, name, planned)))
+
+    def delete_many(self, path, name, mkeys, vdom=None, parameters=None):
+        if self.check_mode:
+            # One listing of the master keys tells which of the objects exist
+            mkeyname = self.get_mkeyname(path, name, vdom)
+            if mkeyname:
+                self.get_table(path, name, vdom=vdom, fields=[mkeyname])
+            return [self._check_mode_delete(path, name, vdom, mkey) for mkey in mkeys]
+
+        requests = [dict(url=self.cmdb_url(path, name, vdom, mkey), params=parameters, data=dumps(None), method='DELETE')
+                    for mkey in mkeys]
+        results = self._send_many(requests)
+        return [self._write_response(path, name, None, mkey, vdom, request, status, result_data)
+                for mkey, request, (status, result_data) in zip(mkeys, requests, results)]
+
+    def delete_vdoms(self, path, name, vdoms, mkey=None, parameters=None, data=None):
+        vdoms = self.resolve_vdoms(vdoms)
+        if mkey is None:
+            mkey = self.get_mkey(path, name, data, vdom=vdoms[0] if vdoms else None)
+        if self.check_mode:
+            return OrderedDict((vdom, self._check_mode_delete(path, name, vdom, mkey)) for vdom in vdoms)
+        requests = [dict(url=self.cmdb_url(path, name, vdom, mkey), params=parameters, data=dumps(None), method='DELETE')
+                    for vdom in vdoms]
+        results = self._send_many(requests)
+        return OrderedDict((vdom, self._write_response(path, name, None, mkey, vdom, request, status, result_data))
+                           for vdom, request, (status, result_data) in zip(vdoms, requests, results))
 
     def delete(self, path, name, vdom=None, mkey=None, parameters=None, data=None):
-        if not mkey:
+        if mkey is None:
             mkey = self.get_mkey(path, name, data, vdom=vdom)
+        if self.check_mode:
+            return self._check_mode_delete(path, name, vdom, mkey)
         url = self.cmdb_url(path, name, vdom, mkey)
-        status, result_data = self._conn.send_request(url=url, params=parameters, data=json.dumps(data), method='DELETE')
-        return self.formatresponse(result_data, vdom=vdom)
+        request = dict(url=url, params=parameters, data=dumps(data), method='DELETE')
+        status, result_data = self._send(**request)
+        return self._write_response(path, name, None, mkey, vdom, request, status, result_data)
+
+    def move(self, path, name, vdom=None, mkey=None, where=None, reference_key=None, parameters=None):
+        if self.check_mode:
+            return {'status': 'success', 'http_method': 'PUT', 'http_status': 200, 'check_mode': True,
+                    'path': path, 'name': name, 'vdom': vdom, 'mkey': mkey, where: reference_key}
+        url = self.cmdb_url(path, name, vdom, mkey)
+        params = dict(parameters or {}, action='move')
+        params[where] = str(reference_key)
+        status, result_data = self._send(url=url, params=params, method='PUT')
+        resp = self.formatresponse(result_data, vdom=vdom)
+        if resp['status'] != 'success':
+            self._transaction_failed = True
+        return resp
+
+    def start_transaction(self, timeout=TRANSACTION_TIMEOUT):
+        if self.check_mode:
+            return {'status': 'success', 'check_mode': True}
+        status, result_data = self._conn.send_request(url='/api/v2/cmdb?action=transaction-start',
+                                                      data=dumps({'timeout': timeout}), method='POST')
+        resp = self.formatresponse(result_data)
+        if resp['status'] == 'success':
+            self._transaction_id = resp['results']['transaction-id']
+            self._transaction_failed = False
+        return resp
+
+    def _end_transaction(self, action):
+        if self.check_mode:
+            resp = {'status': 'success', 'check_mode': True}
+        else:
+            status, result_data = self._send(url='/api/v2/cmdb?action=transaction-' + action, method='POST')
+            resp = self.formatresponse(result_data)
+        self._transaction_id = None
+        # The device config is back to what it was, drop what was learnt meanwhile
+        if action == 'abort':
+            self._tables = {}
+        return resp
+
+    def commit_transaction(self):
+        return self._end_transaction('commit')
+
+    def abort_transaction(self):
+        return self._end_transaction('abort')
+
+    @contextmanager
+    def transaction(self, timeout=TRANSACTION_TIMEOUT):
+        """Run the writes of the block as a single CMDB commit.
+
+        The yielded dictionary holds the response of the start request and,
+        once the block is left, the response of the commit or of the abort
+        done when a write failed or an exception was raised.
+        """
+        result = {'start': self.start_transaction(timeout)}
+        if result['start']['status'] != 'success':
+            yield result
+            return
+        try:
+            yield result
+        except Exception:
+            result['abort'] = self.abort_transaction()
+            raise
+        if self._transaction_failed:
+            result['abort'] = self.abort_transaction()
+        else:
+            result['commit'] = self.commit_transaction()
 
     def formatresponse(self, res, vdom=None):
         if vdom == "global":
-            resp = json.loads(res.decode('utf-8'))[0]
+            resp = loads(res)[0]
             resp['vdom'] = "global"
         else:
-            resp = json.loads(res.decode('utf-8'))
+            resp = loads(res)
         return resp
 
 # BEGIN DEPRECATED
@@ -0,0 +1,376 @@
+# This code is part of Ansible, but is an independent component.
+# This particular file snippet, and this file snippet only, is BSD licensed.
+# Modules you write using this snippet, which is embedded dynamically by Ansible
+# still belong to the author of the module, and may assign their own license
+# to the complete work.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+Code shared by the FortiOS configuration modules.
+
+A module describes the CMDB table it configures with a spec dictionary:
+
+    path:    path of the table, e.g. 'user'
+    name:    name of the table, e.g. 'device'
+    option:  module option holding one object, e.g. 'user_device'
+    mkey:    attribute identifying an object, e.g. 'alias'
+    options: argument spec of the attributes of an object, see load_options()
+
+Login, filtering of the attributes, dispatch and result handling are done here.
+"""
+from contextlib import contextmanager
+
+from ansible.module_utils._text import to_native
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.network.fortimanager.common import FAIL_SOCKET_MSG
+from ansible.module_utils.network.fortios.codec import dumps, loads
+from ansible.module_utils.network.fortios.fortios import FortiOSAPISession, FortiOSDirectConnection, FortiOSHandler
+
+
+def prune_options(options):
+    pruned = {}
+    for name, option in options.items():
+        option = dict((key, value) for key, value in option.items() if not (key == 'required' and value is False))
+        if option.get('options'):
+            option['options'] = prune_options(option['options'])
+        pruned[name] = option
+    return pruned
+
+
+def compile_options(options):
+    """
+    Serialize an argument spec into the table embedded in a module
+    :param options: Argument spec
+    :return: JSON text, without the settings AnsibleModule applies by default
+    """
+    return dumps(prune_options(options))
+
+
+def load_options(table):
+    """
+    Load the argument spec embedded in a module.
+    Modules run from a zip file are compiled again on every task, and parsing a
+    JSON table costs a fraction of compiling the equivalent nested dict literal.
+    :param table: JSON text, as returned by compile_options()
+    :return: Argument spec
+    """
+    return loads(table)
+
+
+def login(data, fos):
+    host = data['host']
+    username = data['username']
+    password = data['password']
+
+    fos.debug('on')
+    if 'https' in data and not data['https']:
+        fos.https('off')
+    else:
+        fos.https('on')
+
+    fos.login(host, username, password)
+
+
+def filter_data(json, option_list):
+    dictionary = {}
+
+    for attribute in option_list:
+        if attribute in json and json[attribute] is not None:
+            dictionary[attribute] = json[attribute]
+
+    return dictionary
+
+
+def underscore_to_hyphen(data):
+    if isinstance(data, list):
+        for elem in data:
+            elem = underscore_to_hyphen(elem)
+    elif isinstance(data, dict):
+        new_data = {}
+        for k, v in data.items():
+            new_data[k.replace('_', '-')] = underscore_to_hyphen(v)
+        data = new_data
+
+    return data
+
+
+def is_successful_status(status):
+    return status['status'] == "success" or \
+        status['http_method'] == "DELETE" and status['http_status'] == 404
+
+
+def is_changed_status(status):
+    return status['status'] == "success" and status.get('revision_changed', True)
+
+
+def resolve_vdoms(vdom, fos):
+    if hasattr(fos, 'resolve_vdoms'):
+        return fos.resolve_vdoms(vdom)
+    if vdom == 'all':
+        resp = fos.get('system', 'vdom')
+        if resp['status'] != "success":
+            return resp
+        return [item['name'] for item in resp['results']]
+    return vdom
+
+
+def object_data(spec, data):
+    return underscore_to_hyphen(filter_data(data, spec['options']))
+
+
+def configure_object(spec, data, fos):
+    vdom = data['vdom']
+    state = data['state']
+    filtered_data = object_data(spec, data[spec['option']])
+
+    if state == "present":
+        return fos.set(spec['path'],
+                       spec['name'],
+                       data=filtered_data,
+                       vdom=vdom)
+
+    elif state == "absent":
+        return fos.delete(spec['path'],
+                          spec['name'],
+                          mkey=filtered_data[spec['mkey']],
+                          vdom=vdom)
+
+
+def configure_objects(spec, data, fos):
+    vdom = data['vdom']
+    state = data['state']
+    filtered_objects = [object_data(spec, item) for item in data['objects']]
+
+    if state == "present":
+        if hasattr(fos, 'set_many'):
+            return fos.set_many(spec['path'],
+                                spec['name'],
+                                filtered_objects,
+                                vdom=vdom)
+        return [fos.set(spec['path'], spec['name'], data=item, vdom=vdom) for item in filtered_objects]
+
+    elif state == "absent":
+        mkeys = [item[spec['mkey']] for item in filtered_objects]
+        if hasattr(fos, 'delete_many'):
+            return fos.delete_many(spec['path'],
+                                   spec['name'],
+                                   mkeys,
+                                   vdom=vdom)
+        return [fos.delete(spec['path'], spec['name'], mkey=mkey, vdom=vdom) for mkey in mkeys]
+
+    elif state == "overridden":
+        if hasattr(fos, 'set_table'):
+            return fos.set_table(spec['path'],
+                                 spec['name'],
+                                 filtered_objects,
+                                 vdom=vdom)
+        return override_objects(spec, filtered_objects, vdom, fos)
+
+
+def override_objects(spec, objects, vdom, fos):
+    mkeyname = fos.get_mkeyname(spec['path'], spec['name'], vdom=vdom)
+    current = fos.get(spec['path'], spec['name'], vdom=vdom)
+    if current['status'] != "success":
+        return [current]
+
+    resps = [fos.set(spec['path'], spec['name'], data=item, vdom=vdom) for item in objects]
+    desired = set(str(item[spec['mkey']]) for item in objects)
+    stale = [entry[mkeyname] for entry in current['results'] if str(entry[mkeyname]) not in desired]
+    return resps + [fos.delete(spec['path'], spec['name'], mkey=mkey, vdom=vdom) for mkey in stale]
+
+
+def configure_vdoms(spec, data, fos):
+    vdoms = resolve_vdoms(data['vdom'], fos)
+    if isinstance(vdoms, dict):
+        # Reading the vdoms failed
+        return True, False, vdoms
+
+    if data[spec['option']] and hasattr(fos, 'set_vdoms'):
+        filtered_data = object_data(spec, data[spec['option']])
+        if data['state'] == "present":
+            resps = fos.set_vdoms(spec['path'], spec['name'], data=filtered_data, vdoms=vdoms)
+        else:
+            resps = fos.delete_vdoms(spec['path'], spec['name'], vdoms=vdoms, mkey=filtered_data[spec['mkey']])
+    else:
+        resps = dict((vdom, fortios_configure(spec, dict(data, vdom=vdom), fos)[2]) for vdom in vdoms)
+
+    statuses = []
+    for resp in resps.values():
+        statuses.extend(resp if isinstance(resp, list) else [resp])
+    return not all(is_successful_status(status) for status in statuses), \
+        any(is_changed_status(status) for status in statuses), \
+        resps
+
+
+def fortios_configure(spec, data, fos):
+
+    if isinstance(data['vdom'], list) or data['vdom'] == 'all':
+        return configure_vdoms(spec, data, fos)
+
+    if data[spec['option']]:
+        resp = configure_object(spec, data, fos)
+    elif data.get('objects') is not None:
+        resps = configure_objects(spec, data, fos)
+        return not all(is_successful_status(resp) for resp in resps), \
+            any(is_changed_status(resp) for resp in resps), \
+            resps
+
+    return not is_successful_status(resp), \
+        is_changed_status(resp), \
+        resp
+
+
+def fortios_configure_in_transaction(spec, data, fos):
+    resp = None
+    with fos.transaction() as transaction:
+        if transaction['start']['status'] == "success":
+            is_error, has_changed, resp = fortios_configure(spec, data, fos)
+
+    if 'commit' not in transaction or transaction['commit']['status'] != "success":
+        return True, False, {'transaction': transaction, 'responses': resp}
+    return is_error, has_changed, resp
+
+
+def collect_diffs(result):
+    # Responses may be nested in lists, per vdom dictionaries or a transaction result
+    if isinstance(result, list):
+        return [diff for item in result for diff in collect_diffs(item)]
+    if not isinstance(result, dict):
+        return []
+    if 'http_method' in result:
+        return [result['diff']] if 'diff' in result else []
+    return [diff for value in result.values() for diff in collect_diffs(value)]
+
+
+@contextmanager
+def direct_connection(module, **kwargs):
+    """
+    Connection opened by the module itself to the FortiGate of its host, username, password and https
+    options, logged out when leaving the block. Failing to log in or any error raised in the block
+    fails the module.
+    :param module: AnsibleModule
+    :param kwargs: Other arguments of FortiOSDirectConnection
+    """
+    connection = FortiOSDirectConnection(module.params['host'],
+                                         username=module.params['username'],
+                                         password=module.params['password'],
+                                         https=module.params['https'],
+                                         **kwargs)
+    try:
+        connection.login()
+    except Exception as e:
+        module.fail_json(msg="Could not log in: %s" % to_native(e))
+    try:
+        yield connection
+    except Exception as e:
+        module.fail_json(msg=to_native(e))
+    finally:
+        try:
+            connection.logout()
+        except Exception:
+            pass
+
+
+def argument_spec(spec):
+    return {
+        "host": {"required": False, "type": "str"},
+        "username": {"required": False, "type": "str"},
+        "password": {"required": False, "type": "str", "no_log": True},
+        "vdom": {"required": False, "type": "raw", "default": "root"},
+        "https": {"required": False, "type": "bool", "default": True},
+        "reuse_session": {"required": False, "type": "bool", "default": False},
+        "transaction": {"required": False, "type": "bool", "default": False},
+        "state": {"required": True, "type": "str",
+                  "choices": ["present", "absent", "overridden"]},
+        spec['option']: {
+            "required": False, "type": "dict",
+            "options": spec['options']
+        },
+        "objects": {
+            "required": False, "type": "list",
+            "options": spec['options']
+        }
+    }
+
+
+def run_module(spec, connection_class):
+    """
+    Entry point of a FortiOS configuration module
+    :param spec: Spec of the CMDB table configured by the module
+    :param connection_class: Class of the persistent connection, the one imported by the module
+    """
+    module = AnsibleModule(argument_spec=argument_spec(spec),
+                           mutually_exclusive=[[spec['option'], "objects"]],
+                           required_one_of=[[spec['option'], "objects"]],
+                           required_if=[["state", "overridden", ["objects"]]],
+                           supports_check_mode=True)
+
+    legacy_mode = 'host' in module.params and module.params['host'] is not None and \
+                  'username' in module.params and module.params['username'] is not None and \
+                  'password' in module.params and module.params['password'] is not None
+
+    if not legacy_mode:
+        if module._socket_path:
+            connection = connection_class(module._socket_path)
+            fos = FortiOSHandler(connection, check_mode=module.check_mode)
+
+            if module.params['transaction']:
+                is_error, has_changed, result = fortios_configure_in_transaction(spec, module.params, fos)
+            else:
+                is_error, has_changed, result = fortios_configure(spec, module.params, fos)
+        else:
+            module.fail_json(**FAIL_SOCKET_MSG)
+    elif module.params['transaction']:
+        module.fail_json(msg="transaction requires the httpapi connection")
+    elif module.check_mode:
+        # fortiosapi has no dry run, read the device through the handler instead
+        with direct_connection(module) as connection:
+            fos = FortiOSHandler(connection, check_mode=True)
+            is_error, has_changed, result = fortios_configure(spec, module.params, fos)
+    else:
+        try:
+            from fortiosapi import FortiOSAPI
+        except ImportError:
+            module.fail_json(msg="fortiosapi module is required")
+
+        fos = FortiOSAPI()
+
+        if module.params['reuse_session']:
+            session = FortiOSAPISession(fos, lambda: login(module.params, fos),
+                                        module.params['host'], module.params['username'],
+                                        https=module.params['https'])
+            session.open()
+            is_error, has_changed, result = fortios_configure(spec, module.params, fos)
+            session.close()
+        else:
+            login(module.params, fos)
+            is_error, has_changed, result = fortios_configure(spec, module.params, fos)
+            fos.logout()
+
+    if not is_error:
+        diffs = collect_diffs(result)
+        if diffs:
+            module.exit_json(changed=has_changed, meta=result, diff=diffs)
+        module.exit_json(changed=has_changed, meta=result)
+    else:
+        module.fail_json(msg="Error in repo", meta=result)
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+from __future__ import (absolute_import, division, print_function)
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'community',
+                    'metadata_version': '1.1'}
+
+DOCUMENTATION = '''
+---
+module: fortios_facts
+short_description: Read CMDB tables of Fortinet's FortiOS and FortiGate.
+description:
+    - This module reads the selected CMDB tables of a FortiGate or FortiOS
+      and returns their entries as facts. The tables are read concurrently,
+      all their pages included.
+version_added: "2.9"
+author:
+    - Miguel Angel Munoz (@mamunozgonzalez)
+    - Nicolas Thomas (@thomnico)
+notes:
+    - Run as a local_action in your playbook, or with the httpapi connection.
+    - Without the httpapi connection, the REST API is used directly and
+      fortiosapi is not required.
+options:
+    host:
+       description:
+            - FortiOS or FortiGate ip address.
+    username:
+        description:
+            - FortiOS or FortiGate username.
+    password:
+        description:
+            - FortiOS or FortiGate password.
+        default: ""
+    vdom:
+        description:
+            - Virtual domain, among those defined previously. A vdom is a
+              virtual instance of the FortiGate that can be configured and
+              used as a different unit.
+        default: root
+    https:
+        description:
+            - Indicates if the requests towards FortiGate must use HTTPS
+              protocol
+        type: bool
+        default: true
+    tables:
+        description:
+            - CMDB tables to read, as C(path/name), for example C(firewall/policy)
+              or C(router/static).
+            - Shell-style wildcards select every matching table of the FortiGate,
+              for example C(firewall/*) or C(system/interface*).
+        type: list
+        required: true
+'''
+
+EXAMPLES = '''
+- hosts: localhost
+  vars:
+   host: "192.168.122.40"
+   username: "admin"
+   password: ""
+   vdom: "root"
+  tasks:
+  - name: Read the policies, interfaces and static routes.
+    fortios_facts:
+      host:  "{{ host }}"
+      username: "{{ username }}"
+      password: "{{ password }}"
+      vdom:  "{{ vdom }}"
+      tables:
+        - "firewall/policy"
+        - "system/interface"
+        - "router/static"
+        - "firewall/addr*"
+
+  - name: Show the names of the policies.
+    debug:
+      msg: "{{ ansible_facts.fortios_cmdb.firewall.policy | map(attribute='name') | list }}"
+'''
+
+RETURN = '''
+ansible_facts:
+  description: Entries of each table read, by path then name
+  returned: always
+  type: complex
+  contains:
+    fortios_cmdb:
+      description: Entries of each table read, by path then name
+      returned: always
+      type: dict
+      sample: {"router": {"static": [{"seq-num": 1, "dst": "0.0.0.0 0.0.0.0", "gateway": "192.168.122.1"}]}}
+    fortios_cmdb_vdom:
+      description: Virtual domain the tables were read from
+      returned: always
+      type: str
+      sample: "root"
+'''
+
+from fnmatch import fnmatchcase
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.connection import Connection
+from ansible.module_utils.network.fortios.fortios import FortiOSHandler
+from ansible.module_utils.network.fortios.runtime import direct_connection
+from ansible.module_utils.network.fortimanager.common import FAIL_SOCKET_MSG
+
+WILDCARD_CHARACTERS = '*?['
+
+# Tables read at the same time without the httpapi connection
+MAX_IN_FLIGHT = 8
+
+
+def resolve_tables(patterns, fos, vdom):
+    tables = []
+    table_names = None
+    for pattern in patterns:
+        if not any(character in pattern for character in WILDCARD_CHARACTERS):
+            tables.append(tuple(pattern.split('/', 1)))
+            continue
+        if table_names is None:
+            table_names = fos.get_table_names(vdom=vdom)
+            if table_names is None:
+                return None
+        tables.extend(table for table in table_names if fnmatchcase('%s/%s' % table, pattern))
+
+    unique_tables = []
+    for table in tables:
+        if table not in unique_tables:
+            unique_tables.append(table)
+    return unique_tables
+
+
+def fortios_facts(data, fos):
+    vdom = data['vdom']
+    for pattern in data['tables']:
+        if '/' not in pattern:
+            return True, {'msg': "tables must be given as path/name, got %s" % pattern}
+
+    tables = resolve_tables(data['tables'], fos, vdom)
+    if tables is None:
+        return True, {'msg': "Could not list the tables to match %s" % ', '.join(data['tables'])}
+    responses = fos.get_tables(tables, vdom=vdom)
+
+    cmdb = {}
+    failed = []
+    for (path, name), resp in responses.items():
+        if resp['status'] != 'success':
+            failed.append('%s/%s' % (path, name))
+            continue
+        cmdb.setdefault(path, {})[name] = resp['results']
+
+    if failed:
+        return True, {'msg': "Could not read %s" % ', '.join(failed)}
+    return False, {'fortios_cmdb': cmdb, 'fortios_cmdb_vdom': vdom}
+
+
+def main():
+    fields = {
+        "host": {"required": False, "type": "str"},
+        "username": {"required": False, "type": "str"},
+        "password": {"required": False, "type": "str", "default": "", "no_log": True},
+        "vdom": {"required": False, "type": "str", "default": "root"},
+        "https": {"required": False, "type": "bool", "default": True},
+        "tables": {"required": True, "type": "list"}
+    }
+
+    module = AnsibleModule(argument_spec=fields,
+                           supports_check_mode=True)
+
+    legacy_mode = module.params['host'] is not None and module.params['username'] is not None
+
+    if not legacy_mode:
+        if module._socket_path:
+            connection = Connection(module._socket_path)
+            is_error, result = fortios_facts(module.params, FortiOSHandler(connection))
+        else:
+            module.fail_json(**FAIL_SOCKET_MSG)
+    else:
+        with direct_connection(module, max_in_flight=MAX_IN_FLIGHT) as connection:
+            is_error, result = fortios_facts(module.params, FortiOSHandler(connection))
+
+    if not is_error:
+        module.exit_json(changed=False, ansible_facts=result)
+    else:
+        module.fail_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+#!/usr/bin/python
+from __future__ import (absolute_import, division, print_function)
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'community',
+                    'metadata_version': '1.1'}
+
+DOCUMENTATION = '''
+---
+module: fortios_fleet
+short_description: Apply one change set to many FortiGates concurrently.
+description:
+    - This module applies the same list of CMDB changes to a list of FortiOS
+      or FortiGate devices, from a single process connecting to many of them
+      at the same time.
+    - Each device gets its own result, and a summary of the run is returned.
+version_added: "2.9"
+author:
+    - Miguel Angel Munoz (@mamunozgonzalez)
+    - Nicolas Thomas (@thomnico)
+notes:
+    - Run as a local_action in your playbook, once for the whole fleet.
+    - Changes use the CMDB attribute names of the REST API, with hyphens.
+    - Supports check mode, which only reads the FortiGates.
+options:
+    devices:
+        description:
+            - FortiGates to change. Options not set for a device are taken
+              from the module options of the same name.
+        required: true
+        suboptions:
+            host:
+                description:
+                    - FortiOS or FortiGate ip address.
+                required: true
+            username:
+                description:
+                    - FortiOS or FortiGate username.
+            password:
+                description:
+                    - FortiOS or FortiGate password.
+            access_token:
+                description:
+                    - REST API administrator key, used instead of username
+                      and password.
+            https:
+                description:
+                    - Indicates if the requests towards FortiGate must use HTTPS
+                      protocol
+                type: bool
+            ssl_verify:
+                description:
+                    - Validate the certificate of the FortiGate.
+                type: bool
+    username:
+        description:
+            - FortiOS or FortiGate username.
+    password:
+        description:
+            - FortiOS or FortiGate password.
+        default: ""
+    access_token:
+        description:
+            - REST API administrator key, used instead of username and password.
+    https:
+        description:
+            - Indicates if the requests towards FortiGate must use HTTPS
+              protocol
+        type: bool
+        default: true
+    ssl_verify:
+        description:
+            - Validate the certificates of the FortiGates.
+        type: bool
+        default: true
+    timeout:
+        description:
+            - Seconds to wait for each answer of a FortiGate.
+        type: int
+        default: 60
+    forks:
+        description:
+            - Maximum number of FortiGates changed at the same time.
+        type: int
+        default: 50
+    max_fail_percentage:
+        description:
+            - Percentage of FortiGates allowed to fail before the task fails.
+        type: int
+        default: 0
+    transaction:
+        description:
+            - Apply the changes of each FortiGate in a single CMDB transaction,
+              committed when every change succeeded and aborted otherwise.
+              Requires a FortiOS version with REST API transaction support.
+        type: bool
+        default: false
+    changes:
+        description:
+            - CMDB changes applied, in order, to every FortiGate.
+            - The changes following a failed one are not applied to that FortiGate.
+        required: true
+        suboptions:
+            path:
+                description:
+                    - Path of the CMDB table, for example C(firewall).
+                required: true
+            name:
+                description:
+                    - Name of the CMDB table, for example C(addrgrp).
+                required: true
+            data:
+                description:
+                    - Attributes of the object.
+                type: dict
+            mkey:
+                description:
+                    - Master key of the object. Taken from I(data) when not set.
+            vdom:
+                description:
+                    - Virtual domain of the object.
+                default: root
+            state:
+                description:
+                    - Indicates whether to create or remove the object
+                choices:
+                    - present
+                    - absent
+                default: present
+'''
+
+EXAMPLES = '''
+- hosts: localhost
+  vars:
+   username: "admin"
+   password: ""
+  tasks:
+  - name: Add a server to the address group of every branch.
+    fortios_fleet:
+      username: "{{ username }}"
+      password: "{{ password }}"
+      ssl_verify: "False"
+      forks: 100
+      devices:
+        - host: "192.168.122.40"
+        - host: "192.168.122.41"
+          access_token: "<your_own_value>"
+      changes:
+        - path: "firewall"
+          name: "address"
+          data:
+            name: "backup-server"
+            subnet: "10.0.0.10 255.255.255.255"
+        - path: "firewall"
+          name: "addrgrp"
+          data:
+            name: "servers"
+            member:
+              - name: "backup-server"
+'''
+
+RETURN = '''
+results:
+  description: Result of each FortiGate, in the order of I(devices)
+  returned: always
+  type: list
+  sample: [{"host": "192.168.122.40", "failed": false, "changed": true, "responses": [{"status": "success"}]}]
+summary:
+  description: Number of FortiGates changed, unchanged and failed, and run time in seconds
+  returned: always
+  type: dict
+  sample: {"total": 600, "changed": 590, "ok": 8, "failed": 2, "elapsed": 312.5}
+'''
+
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from ansible.module_utils._text import to_native
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.network.fortios.fortios import FortiOSDirectConnection, FortiOSHandler
+from ansible.module_utils.network.fortios.runtime import is_changed_status, is_successful_status
+
+DEVICE_DEFAULTS = ('username', 'password', 'access_token', 'https', 'ssl_verify')
+
+
+def options_error(data):
+    for index, change in enumerate(data['changes']):
+        if change['state'] == "present" and not change['data']:
+            return "changes[%d]: data is required with state present" % index
+        if change['state'] == "absent" and change['mkey'] is None and not change['data']:
+            return "changes[%d]: mkey or data is required with state absent" % index
+    for device in data['devices']:
+        if all(device.get(option) is None and data[option] is None for option in ('username', 'access_token')):
+            return "%s: username or access_token is required" % device['host']
+    return None
+
+
+def apply_changes(changes, fos):
+    responses = []
+    for change in changes:
+        if change['state'] == "present":
+            # Devices are changed concurrently, each one gets its own copy
+            resp = fos.set(change['path'],
+                           change['name'],
+                           data=dict(change['data']),
+                           mkey=change['mkey'],
+                           vdom=change['vdom'])
+        else:
+            resp = fos.delete(change['path'],
+                              change['name'],
+                              mkey=change['mkey'],
+                              data=change['data'],
+                              vdom=change['vdom'])
+        responses.append(resp)
+        if not is_successful_status(resp):
+            break
+    return responses
+
+
+def fortios_device(device, data, check_mode=False):
+    result = {'host': device['host'], 'failed': False, 'changed': False, 'responses': []}
+    conn = FortiOSDirectConnection(device['host'],
+                                   username=device['username'],
+                                   password=device['password'],
+                                   access_token=device['access_token'],
+                                   https=device['https'],
+                                   ssl_verify=device['ssl_verify'],
+                                   timeout=data['timeout'])
+    try:
+        conn.login()
+    except Exception as e:
+        result.update(failed=True, msg="Could not log in: %s" % to_native(e))
+        return result
+
+    try:
+        fos = FortiOSHandler(conn, check_mode=check_mode)
+        if data['transaction']:
+            with fos.transaction() as transaction:
+                if transaction['start']['status'] == "success":
+                    result['responses'] = apply_changes(data['changes'], fos)
+            result['transaction'] = transaction
+            committed = 'commit' in transaction and transaction['commit']['status'] == "success"
+        else:
+            result['responses'] = apply_changes(data['changes'], fos)
+            committed = True
+    except Exception as e:
+        result.update(failed=True, msg=to_native(e))
+        committed = False
+    finally:
+        try:
+            conn.logout()
+        except Exception:
+            pass
+
+    responses = result['responses']
+    if not committed or len(responses) < len(data['changes']) or \
+            not all(is_successful_status(resp) for resp in responses):
+        result['failed'] = True
+        result.setdefault('msg', "Error in repo")
+    else:
+        result['changed'] = any(is_changed_status(resp) for resp in responses)
+    return result
+
+
+def fortios_fleet(data, log=None, check_mode=False):
+    devices = []
+    for device in data['devices']:
+        device = dict(device)
+        for option in DEVICE_DEFAULTS:
+            if device.get(option) is None:
+                device[option] = data[option]
+        devices.append(device)
+
+    started = time.time()
+    results = [None] * len(devices)
+    failed = 0
+    pool = ThreadPool(max(1, min(data['forks'], len(devices))))
+    try:
+        tasks = pool.imap_unordered(lambda item: (item[0], fortios_device(item[1], data, check_mode)), enumerate(devices))
+        for done, (index, result) in enumerate(tasks, 1):
+            results[index] = result
+            failed += result['failed']
+            if log:
+                log('fortios_fleet: %d/%d devices done, %d failed' % (done, len(devices), failed))
+    finally:
+        pool.close()
+        pool.join()
+
+    changed = sum(1 for result in results if result['changed'])
+    summary = {'total': len(devices),
+               'changed': changed,
+               'ok': len(devices) - changed - failed,
+               'failed': failed,
+               'elapsed': round(time.time() - started, 1)}
+    return results, summary
+
+
+def main():
+    fields = {
+        "devices": {
+            "required": True, "type": "list",
+            "options": {
+                "host": {"required": True, "type": "str"},
+                "username": {"required": False, "type": "str"},
+                "password": {"required": False, "type": "str", "no_log": True},
+                "access_token": {"required": False, "type": "str", "no_log": True},
+                "https": {"required": False, "type": "bool"},
+                "ssl_verify": {"required": False, "type": "bool"}
+            }
+        },
+        "username": {"required": False, "type": "str"},
+        "password": {"required": False, "type": "str", "default": "", "no_log": True},
+        "access_token": {"required": False, "type": "str", "no_log": True},
+        "https": {"required": False, "type": "bool", "default": True},
+        "ssl_verify": {"required": False, "type": "bool", "default": True},
+        "timeout": {"required": False, "type": "int", "default": 60},
+        "forks": {"required": False, "type": "int", "default": 50},
+        "max_fail_percentage": {"required": False, "type": "int", "default": 0},
+        "transaction": {"required": False, "type": "bool", "default": False},
+        "changes": {
+            "required": True, "type": "list",
+            "options": {
+                "path": {"required": True, "type": "str"},
+                "name": {"required": True, "type": "str"},
+                "data": {"required": False, "type": "dict"},
+                "mkey": {"required": False, "type": "str"},
+                "vdom": {"required": False, "type": "str", "default": "root"},
+                "state": {"required": False, "type": "str", "default": "present",
+                          "choices": ["present", "absent"]}
+            }
+        }
+    }
+
+    module = AnsibleModule(argument_spec=fields,
+                           supports_check_mode=True)
+
+    error = options_error(module.params)
+    if error:
+        module.fail_json(msg=error)
+
+    results, summary = fortios_fleet(module.params, log=module.log, check_mode=module.check_mode)
+
+    if summary['failed'] * 100 > module.params['max_fail_percentage'] * summary['total']:
+        module.fail_json(msg="%d of %d devices failed" % (summary['failed'], summary['total']),
+                         results=results, summary=summary)
+    module.exit_json(changed=summary['changed'] > 0, results=results, summary=summary)
+
+
+if __name__ == '__main__':
+    main()
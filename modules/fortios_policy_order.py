@@ -0,0 +1,185 @@
+#!/usr/bin/python
+from __future__ import (absolute_import, division, print_function)
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'community',
+                    'metadata_version': '1.1'}
+
+DOCUMENTATION = '''
+---
+module: fortios_policy_order
+short_description: Order the policies of Fortinet's FortiOS and FortiGate.
+description:
+    - This module puts the policies of a FortiGate or FortiOS policy table
+      in the given sequence.
+    - The policies already in the right order relative to each other stay in
+      place and only the other ones are moved, with the fewest move requests.
+version_added: "2.9"
+author:
+    - Miguel Angel Munoz (@mamunozgonzalez)
+    - Nicolas Thomas (@thomnico)
+notes:
+    - Run as a local_action in your playbook, or with the httpapi connection.
+    - Without the httpapi connection, the REST API is used directly and
+      fortiosapi is not required.
+    - Supports check mode, which reports the moves without sending them.
+options:
+    host:
+       description:
+            - FortiOS or FortiGate ip address.
+    username:
+        description:
+            - FortiOS or FortiGate username.
+    password:
+        description:
+            - FortiOS or FortiGate password.
+        default: ""
+    vdom:
+        description:
+            - Virtual domain, among those defined previously. A vdom is a
+              virtual instance of the FortiGate that can be configured and
+              used as a different unit.
+        default: root
+    https:
+        description:
+            - Indicates if the requests towards FortiGate must use HTTPS
+              protocol
+        type: bool
+        default: true
+    path:
+        description:
+            - Path of the policy table.
+        default: firewall
+    name:
+        description:
+            - Name of the policy table, for example C(policy6) or C(proxy-policy).
+        default: policy
+    sequence:
+        description:
+            - Ids of the policies, in the order the FortiGate must evaluate them.
+            - Policies which are not listed keep their place, the listed ones
+              are only ordered relative to each other.
+        type: list
+        required: true
+'''
+
+EXAMPLES = '''
+- hosts: localhost
+  vars:
+   host: "192.168.122.40"
+   username: "admin"
+   password: ""
+   vdom: "root"
+  tasks:
+  - name: Evaluate the deny policies first.
+    fortios_policy_order:
+      host:  "{{ host }}"
+      username: "{{ username }}"
+      password: "{{ password }}"
+      vdom:  "{{ vdom }}"
+      sequence:
+        - 12
+        - 3
+        - 7
+        - 1
+'''
+
+RETURN = '''
+moves:
+  description: Moves applied, in order
+  returned: always
+  type: list
+  sample: [{"mkey": "12", "where": "before", "reference_key": "3"}]
+meta:
+  description: Response of each move sent
+  returned: always
+  type: list
+  sample: [{"status": "success", "http_method": "PUT", "http_status": 200}]
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.connection import Connection
+from ansible.module_utils.network.fortios.fortios import FortiOSHandler, plan_moves
+from ansible.module_utils.network.fortios.runtime import direct_connection
+from ansible.module_utils.network.fortimanager.common import FAIL_SOCKET_MSG
+
+
+def fortios_policy_order(data, fos):
+    path, name, vdom = data['path'], data['name'], data['vdom']
+    sequence = [str(mkey) for mkey in data['sequence']]
+    if len(set(sequence)) != len(sequence):
+        return True, False, {'msg': "sequence lists a policy more than once"}
+
+    current = fos.get_order(path, name, vdom=vdom)
+    if current is None:
+        return True, False, {'msg': "Could not read %s/%s" % (path, name)}
+    existing = set(current)
+    missing = [mkey for mkey in sequence if mkey not in existing]
+    if missing:
+        return True, False, {'msg': "No such policies: %s" % ', '.join(missing)}
+
+    moves = []
+    responses = []
+    for mkey, where, reference_key in plan_moves(current, sequence):
+        resp = fos.move(path, name, vdom=vdom, mkey=mkey, where=where, reference_key=reference_key)
+        moves.append({'mkey': mkey, 'where': where, 'reference_key': reference_key})
+        responses.append(resp)
+        # Later moves are relative to the position of this one
+        if resp['status'] != 'success':
+            return True, True, {'msg': "Error in repo", 'moves': moves, 'meta': responses}
+    return False, bool(moves), {'moves': moves, 'meta': responses}
+
+
+def main():
+    fields = {
+        "host": {"required": False, "type": "str"},
+        "username": {"required": False, "type": "str"},
+        "password": {"required": False, "type": "str", "default": "", "no_log": True},
+        "vdom": {"required": False, "type": "str", "default": "root"},
+        "https": {"required": False, "type": "bool", "default": True},
+        "path": {"required": False, "type": "str", "default": "firewall"},
+        "name": {"required": False, "type": "str", "default": "policy"},
+        "sequence": {"required": True, "type": "list"}
+    }
+
+    module = AnsibleModule(argument_spec=fields,
+                           supports_check_mode=True)
+
+    legacy_mode = module.params['host'] is not None and module.params['username'] is not None
+
+    if not legacy_mode:
+        if module._socket_path:
+            connection = Connection(module._socket_path)
+            fos = FortiOSHandler(connection, check_mode=module.check_mode)
+            is_error, has_changed, result = fortios_policy_order(module.params, fos)
+        else:
+            module.fail_json(**FAIL_SOCKET_MSG)
+    else:
+        with direct_connection(module) as connection:
+            fos = FortiOSHandler(connection, check_mode=module.check_mode)
+            is_error, has_changed, result = fortios_policy_order(module.params, fos)
+
+    if not is_error:
+        module.exit_json(changed=has_changed, **result)
+    else:
+        module.fail_json(changed=has_changed, **result)
+
+
+if __name__ == '__main__':
+    main()
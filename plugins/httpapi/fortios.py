@@ -39,15 +39,282 @@ short_description: HttpApi Plugin for Fortinet FortiOS Appliance or VM
 description:
   - This HttpApi plugin provides methods to connect to Fortinet FortiOS Appliance or VM via REST API
 version_added: "2.9"
+options:
+  access_token:
+    type: str
+    description:
+      - REST API administrator key.
+      - When set, requests are authenticated with a bearer token in the C(Authorization)
+        header and no login or logout is done, so the session does not count against
+        the admin login limits.
+    vars:
+      - name: ansible_httpapi_fortios_access_token
+  keep_alive:
+    type: bool
+    description:
+      - Keep connections to the device open between requests, for the life of the persistent
+        connection, so consecutive requests and tasks do not connect and negotiate TLS again.
+      - When a connection has to be opened again, the TLS session of a previous one is resumed
+        instead of doing a full handshake.
+      - When disabled, every request opens a new connection.
+      - Requests are then sent by this plugin instead of the C(send) method of the httpapi
+        connection. Only the I(validate_certs) and I(timeout) options of the connection apply to
+        them. Proxies set in the environment (C(https_proxy), C(http_proxy), C(no_proxy)) are not
+        used, requests and responses are not written to the log enabled by
+        I(persistent_log_messages), and an unreachable device is reported with the socket error
+        instead of AnsibleConnectionFailure. Disable this option when the device is reached through
+        a proxy or when those logs are needed.
+    default: True
+    vars:
+      - name: ansible_httpapi_fortios_keep_alive
+  max_in_flight:
+    type: int
+    description:
+      - Maximum number of requests sent concurrently by C(send_requests).
+      - The number actually allowed starts at one and adapts to the device, growing while
+        requests succeed within I(latency_target) and halving on server errors, timeouts
+        or slow answers.
+    default: 8
+    vars:
+      - name: ansible_httpapi_fortios_max_in_flight
+  latency_target:
+    type: float
+    description:
+      - Response time, in seconds, above which the device is considered overloaded and
+        fewer concurrent requests are allowed.
+    default: 2.0
+    vars:
+      - name: ansible_httpapi_fortios_latency_target
+  retries:
+    type: int
+    description:
+      - Number of times a request is sent again after a transient failure.
+      - GET, PUT and DELETE are retried on transport errors and on 429, 502, 503 and 504 answers.
+        POST is only retried on 429 and 503, which the device sends before processing it.
+      - Waits between attempts grow exponentially from I(retry_backoff), with random jitter.
+      - Independently of this, a request answered with 401 is sent again once after logging in again.
+    default: 3
+    vars:
+      - name: ansible_httpapi_fortios_retries
+  retry_backoff:
+    type: float
+    description:
+      - Base wait, in seconds, before retrying a request.
+    default: 0.5
+    vars:
+      - name: ansible_httpapi_fortios_retry_backoff
+  request_compression_min_size:
+    type: int
+    description:
+      - Request bodies of at least this many bytes, such as replacement message images or
+        certificates, are sent gzip compressed with C(gzip) as C(Content-Encoding).
+      - Only set it for devices known to accept compressed request bodies. C(0) disables it.
+      - Responses are always requested gzip compressed, and decompressed transparently.
+    default: 0
+    vars:
+      - name: ansible_httpapi_fortios_request_compression_min_size
+  schema_cache_size:
+    type: int
+    description:
+      - Maximum number of CMDB table schemas kept for the life of the persistent connection.
+      - Least recently used schemas are evicted first.
+    default: 256
+    vars:
+      - name: ansible_httpapi_fortios_schema_cache_size
+  schema_store_path:
+    type: path
+    description:
+      - Directory holding CMDB schema bundles, one gzip compressed JSON file per FortiOS build.
+      - Schemas are read from the bundle matching the device firmware before being requested
+        from the device, and schemas fetched from the device are added to it.
+      - When not set, schemas are only cached in memory.
+    vars:
+      - name: ansible_httpapi_fortios_schema_store_path
 
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import gzip
+import http.client
+import socket
+import ssl
+import threading
+import time
+
 from ansible.plugins.httpapi import HttpApiBase
-from ansible.module_utils.basic import to_text
-import urllib
-import json
+from ansible.module_utils.basic import to_bytes, to_text
+from ansible.module_utils.network.fortios.codec import loads
+from ansible.module_utils.network.fortios.fortios import SchemaCache, SchemaStore
+import urllib.parse
+import random
 import re
 
+# Methods which leave the device in the same state when sent twice
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+
+# Answers sent before the request was processed, or by a device busy or failing over
+RETRY_STATUSES = {
+    'GET': (429, 502, 503, 504),
+    'PUT': (429, 502, 503, 504),
+    'DELETE': (429, 502, 503, 504),
+    'POST': (429, 503),
+}
+
+# Longest wait, in seconds, between two attempts of a request
+RETRY_BACKOFF_MAX = 30
+
+
+class AdaptiveLimiter(object):
+    """
+    Additive increase / multiplicative decrease limit on the requests in flight.
+
+    The window grows by one once a full window of requests succeeded within the
+    latency target and is halved on a failure or a slow answer, at most once for
+    the requests sent before the previous decrease.
+    """
+
+    # Weight of the last sample in the latency and error rate averages
+    SMOOTHING = 0.2
+
+    def __init__(self, maximum, latency_target, minimum=1):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.window = float(minimum)
+        self.in_flight = 0
+        self.latency = None
+        self.error_rate = 0.0
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.window):
+                self._condition.wait()
+            self.in_flight += 1
+        return time.time()
+
+    def release(self, started, failed):
+        with self._condition:
+            self.in_flight -= 1
+            latency = time.time() - started
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.SMOOTHING * (latency - self.latency)
+            self.error_rate += self.SMOOTHING * ((1.0 if failed else 0.0) - self.error_rate)
+
+            if failed or latency > self.latency_target:
+                if started >= self._decreased_at:
+                    self.window = max(float(self.minimum), self.window / 2)
+                    self._decreased_at = time.time()
+            else:
+                self.window = min(float(self.maximum), self.window + 1.0 / int(self.window))
+            self._condition.notify_all()
+
+    def state(self):
+        with self._condition:
+            return dict(window=int(self.window), in_flight=self.in_flight,
+                        latency=self.latency, error_rate=self.error_rate)
+
+
+class ResumingHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection resuming the last TLS session negotiated by its pool."""
+
+    def __init__(self, pool, *args, **kwargs):
+        super(ResumingHTTPSConnection, self).__init__(*args, **kwargs)
+        self._pool = pool
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout, self.source_address)
+        kwargs = {}
+        if self._pool.tls_session is not None:
+            kwargs['session'] = self._pool.tls_session
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host, **kwargs)
+
+
+class KeepAlivePool(object):
+    """
+    Connections to one device kept open between requests.
+
+    A request takes an idle connection, or opens a new one, and gives it back once
+    the response is read. Idle connections closed by the device are replaced
+    transparently.
+    """
+
+    def __init__(self, url, validate_certs, timeout, maxsize):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.tls_session = None
+        self._idle = []
+        self._lock = threading.Lock()
+        self._context = None
+        if parsed.scheme == 'https':
+            self._context = ssl.create_default_context()
+            if not validate_certs:
+                self._context.check_hostname = False
+                self._context.verify_mode = ssl.CERT_NONE
+
+    def _connect(self):
+        if self._context is None:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return ResumingHTTPSConnection(self, self.host, self.port, timeout=self.timeout, context=self._context)
+
+    def _take(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _give_back(self, connection, reusable):
+        # TLS 1.3 session tickets only arrive after the handshake, keep the latest one
+        session = getattr(connection.sock, 'session', None)
+        with self._lock:
+            if session is not None:
+                self.tls_session = session
+            if reusable and len(self._idle) < self.maxsize:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, url, body, headers):
+        """
+        Send a request and read its response
+        :param method: HTTP method
+        :param url: Path and query string
+        :param body: Request body, bytes or None
+        :param headers: Request headers
+        :return: Response object and response body
+        """
+        while True:
+            connection, reused = self._take()
+            try:
+                connection.request(method, url, body=body, headers=headers)
+                response = connection.getresponse()
+                response_body = response.read()
+            except ConnectionError:
+                connection.close()
+                # The device closed the idle connection before reading the request
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            self._give_back(connection, not response.will_close)
+            return response, response_body
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
 
 class HttpApi(HttpApiBase):
     def __init__(self, connection):
@@ -57,6 +324,14 @@ class HttpApi(HttpApiBase):
         self._become = False
         self._become_pass = ''
         self._ccsrftoken = ''
+        self._schema_cache = None
+        self._schema_store = None
+        self._system_status = None
+        self._limiter = None
+        self._limiter_lock = threading.Lock()
+        self._login_lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
 
     def set_become(self, become_context):
         """
@@ -69,6 +344,11 @@ class HttpApi(HttpApiBase):
     def login(self, username, password):
         """Call a defined login endpoint to receive an authentication token."""
 
+        access_token = self.get_option('access_token')
+        if access_token:
+            self._connection._auth = {'Authorization': 'Bearer ' + access_token}
+            return
+
         data = "username=" + urllib.parse.quote(username) + "&secretkey=" + urllib.parse.quote(password) + "&ajax=1"
         dummy, result_data = self.send_request(url='/logincheck', data=data, method='POST')
         if result_data[0] != '1':
@@ -77,7 +357,11 @@ class HttpApi(HttpApiBase):
     def logout(self):
         """ Call to implement session logout."""
 
-        self.send_request(url='/logout', method="POST")
+        if not self.get_option('access_token'):
+            self.send_request(url='/logout', method="POST")
+
+        if self._pool is not None:
+            self._pool.close()
 
     def update_auth(self, response, response_text):
         """
@@ -87,6 +371,10 @@ class HttpApi(HttpApiBase):
         :return: Dictionary containing cookies
         """
 
+        # API keys do not expire with the session, there is nothing to update
+        if self.get_option('access_token'):
+            return None
+
         cookies = {}
 
         for attr, val in response.getheaders():
@@ -100,6 +388,111 @@ class HttpApi(HttpApiBase):
 
         return cookies
 
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = KeepAlivePool(self._connection._url, self._connection.get_option('validate_certs'),
+                                           self._connection.get_option('timeout'), self.get_option('max_in_flight'))
+        return self._pool
+
+    def _send(self, url, data, headers, method):
+        if not self.get_option('keep_alive'):
+            return self._connection.send(url, data, headers=headers, method=method)
+
+        if self._connection._auth:
+            headers = dict(headers)
+            headers.update(self._connection._auth)
+        body = to_bytes(data) if data else None
+        response, response_body = self._get_pool().request(method, url, body, headers)
+
+        # Same bookkeeping as the connection does for its own requests
+        self._connection._auth = self.update_auth(response, BytesIO(response_body)) or self._connection._auth
+        return response, BytesIO(response_body)
+
+    def _get_limiter(self):
+        with self._limiter_lock:
+            if self._limiter is None:
+                self._limiter = AdaptiveLimiter(self.get_option('max_in_flight'), self.get_option('latency_target'))
+        return self._limiter
+
+    def get_concurrency_window(self):
+        """
+        Current state of the adaptive limit on concurrent requests to this device
+        :return: Dictionary with window, in_flight, latency (seconds, smoothed) and error_rate
+        """
+        return self._get_limiter().state()
+
+    def _get_schema_cache(self):
+        if self._schema_cache is None:
+            self._schema_cache = SchemaCache(self.get_option('schema_cache_size'))
+        return self._schema_cache
+
+    def _get_schema_store(self):
+        if self._schema_store is None:
+            self._schema_store = False
+            directory = self.get_option('schema_store_path')
+            if directory:
+                device = self.get_system_status()
+                if device:
+                    self._schema_store = SchemaStore(directory, device['version'], device['build'],
+                                                     log=lambda message: self._connection.queue_message('warning', message))
+        return self._schema_store
+
+    def get_system_status(self):
+        """
+        Firmware version and build of the device, read once per connection
+        :return: Dictionary with version, build and serial, or None if the device did not answer
+        """
+        if self._system_status is None:
+            status, result_data = self.send_request(url='/api/v2/monitor/system/status')
+            if status != 200:
+                return None
+            result = loads(result_data)
+            self._system_status = dict(version=result['version'], build=result['build'], serial=result['serial'])
+        return self._system_status
+
+    def get_cached_schema(self, path, name, vdom=None):
+        """
+        Look up a CMDB table schema fetched earlier on this connection or kept in the schema store
+        :param path: First part of the CMDB url, e.g. firewall
+        :param name: Second part of the CMDB url, e.g. address
+        :param vdom: Vdom the schema was requested for
+        :return: The schema, or None if it is not cached
+        """
+        cache = self._get_schema_cache()
+        schema = cache.get(path, name, vdom)
+        if schema is None:
+            store = self._get_schema_store()
+            if store:
+                schema = store.get(path, name, vdom)
+                if schema is not None:
+                    cache.put(path, name, schema, vdom=vdom)
+        return schema
+
+    def cache_schema(self, path, name, schema, vdom=None):
+        """
+        Keep a CMDB table schema for the following tasks using this connection
+        :param path: First part of the CMDB url, e.g. firewall
+        :param name: Second part of the CMDB url, e.g. address
+        :param schema: Schema returned by the device
+        :param vdom: Vdom the schema was requested for
+        :return: None
+        """
+        self._get_schema_cache().put(path, name, schema, vdom=vdom)
+        store = self._get_schema_store()
+        if store:
+            store.put(path, name, schema, vdom=vdom)
+
+    def invalidate_schema_cache(self, path=None, name=None, vdom=None):
+        """
+        Drop cached schemas, all of them when no filter is given
+        :param path: Only drop schemas under this path
+        :param name: Only drop schemas with this table name
+        :param vdom: Only drop schemas of this vdom scope
+        :return: None
+        """
+        self._get_schema_cache().invalidate(path, name, vdom)
+
     def handle_httperror(self, exc):
         """
         Not required on Fortinet devices - Skipped
@@ -111,27 +504,109 @@ class HttpApi(HttpApiBase):
     def send_request(self, **message_kwargs):
         """
         Responsible for actual sending of data to the connection httpapi base plugin.
-        :param message_kwargs: A formatted dictionary containing request info: url, data, method
+        :param message_kwargs: A formatted dictionary containing request info: url, data, method, params, headers
 
         :return: Status code and response data.
         """
         url = message_kwargs.get('url', '/')
         data = message_kwargs.get('data', '')
         method = message_kwargs.get('method', 'GET')
+        params = message_kwargs.get('params')
 
-        if self._ccsrftoken == '' and not (method == 'POST' and 'logincheck' in url):
+        if params:
+            url += ('&' if '?' in url else '?') + urllib.parse.urlencode(params)
+
+        token_auth = bool(self.get_option('access_token'))
+        login_request = method == 'POST' and 'logincheck' in url
+        if not token_auth and self._ccsrftoken == '' and not login_request:
             raise Exception('Not logged in. Please login first')
 
-        headers = {}
-        if self._ccsrftoken != '':
-            headers['x-csrftoken'] = self._ccsrftoken
+        compression_min_size = self.get_option('request_compression_min_size')
+        compressed = bool(data) and compression_min_size > 0 and len(data) >= compression_min_size
+        if compressed:
+            data = gzip.compress(to_bytes(data))
+
+        retries = self.get_option('retries')
+        attempt = 0
+        relogged = False
+        while True:
+            ccsrftoken = self._ccsrftoken
+            headers = dict(message_kwargs.get('headers') or {})
+            if ccsrftoken != '':
+                headers['x-csrftoken'] = ccsrftoken
+
+            if method == 'POST' or 'PUT':
+                headers['Content-Type'] = 'application/json'
+
+            headers['Accept-Encoding'] = 'gzip'
+            if compressed:
+                headers['Content-Encoding'] = 'gzip'
 
-        if method == 'POST' or 'PUT':
-            headers['Content-Type'] = 'application/json'
+            limiter = self._get_limiter()
+            started = limiter.acquire()
+            try:
+                response, response_data = self._send(url, data, headers, method)
+            except Exception as err:
+                limiter.release(started, failed=True)
+                if attempt < retries and method in IDEMPOTENT_METHODS:
+                    attempt += 1
+                    self._backoff(attempt, method, url, err)
+                    continue
+                raise Exception(err)
 
-        try:
-            response, response_data = self._connection.send(url, data, headers=headers, method=method)
+            status = response.status
+            limiter.release(started, failed=status >= 500 or status == 429)
+            response_body = response_data.getvalue()
+            if response.info().get('Content-Encoding') == 'gzip':
+                response_body = gzip.decompress(response_body)
+            response_text = to_text(response_body)
+
+            if self._session_expired(status, response_text) and not (relogged or token_auth or login_request):
+                relogged = True
+                self._relogin(ccsrftoken)
+                continue
+            if attempt < retries and status in RETRY_STATUSES.get(method, ()):
+                attempt += 1
+                self._backoff(attempt, method, url, status)
+                continue
+            return status, response_text
+
+    @staticmethod
+    def _session_expired(status, response_text):
+        return status == 401 or (status == 403 and 'csrf' in response_text.lower())
+
+    def _relogin(self, ccsrftoken):
+        with self._login_lock:
+            # Requests failing together only need one of them to log in again
+            if self._ccsrftoken != ccsrftoken:
+                return
+            self._connection.queue_message('vvv', 'FortiOS session expired, logging in again')
+            self._connection._auth = None
+            self.login(self._connection.get_option('remote_user'), self._connection.get_option('password'))
+
+    def _backoff(self, attempt, method, url, reason):
+        delay = random.uniform(0, min(RETRY_BACKOFF_MAX, self.get_option('retry_backoff') * 2 ** (attempt - 1)))
+        self._connection.queue_message('vvv', 'retrying %s %s in %.2fs after %s' % (method, url, delay, reason))
+        time.sleep(delay)
+
+    def send_requests(self, requests, max_in_flight=None):
+        """
+        Send many requests concurrently over this connection.
+        :param requests: List of requests, each one either a dictionary with the send_request arguments
+                         or a (method, url, data) sequence
+        :param max_in_flight: Maximum number of worker threads, the max_in_flight option by default.
+                              The adaptive limit may allow fewer requests at the same time.
+
+        :return: List of status code and response data, in the order of the requests.
+        """
+        message_kwargs_list = []
+        for request in requests:
+            if isinstance(request, dict):
+                message_kwargs_list.append(request)
+            else:
+                method, url, data = request
+                message_kwargs_list.append(dict(method=method, url=url, data=data))
 
-            return response.status, to_text(response_data.getvalue())
-        except Exception as err:
-            raise Exception(err)
+        workers = max_in_flight or self.get_option('max_in_flight')
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda message_kwargs: self.send_request(**message_kwargs), message_kwargs_list))
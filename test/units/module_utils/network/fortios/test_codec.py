@@ -0,0 +1,42 @@
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <https://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+
+from ansible.module_utils.network.fortios import codec
+
+
+DOCUMENT = {'results': [{'name': 'café', 'subnet': '10.0.0.1/32', 'q_origin_key': 1}], 'status': 'success'}
+
+
+def test_loads_accepts_bytes_and_text():
+    data = json.dumps(DOCUMENT)
+    assert codec.loads(data) == DOCUMENT
+    assert codec.loads(data.encode('utf-8')) == DOCUMENT
+
+
+def test_dumps_returns_text():
+    data = codec.dumps(DOCUMENT)
+    assert isinstance(data, type(u''))
+    assert json.loads(data) == DOCUMENT
+
+
+def test_stdlib_backend(mocker):
+    mocker.patch.object(codec, 'BACKEND', 'json')
+    assert codec.loads(codec.dumps(DOCUMENT).encode('utf-8')) == DOCUMENT
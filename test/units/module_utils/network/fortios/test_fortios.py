@@ -0,0 +1,562 @@
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <https://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import pytest
+
+from ansible.module_utils.network.fortios.codec import dumps
+from ansible.module_utils.network.fortios.fortios import (FortiOSAPISession, FortiOSDirectConnection, FortiOSHandler,
+                                                          SchemaCache, SchemaStore, config_diff, plan_moves)
+
+
+SCHEMA_RESPONSE = json.dumps({'results': {'mkey': 'name', 'mkey_type': 'string'}}).encode('utf-8')
+
+
+@pytest.fixture
+def conn(mocker):
+    conn = mocker.Mock()
+    conn.get_cached_schema.return_value = None
+    conn.send_request.return_value = (200, SCHEMA_RESPONSE)
+    return conn
+
+
+def test_schema_cache_evicts_least_recently_used():
+    cache = SchemaCache(maxsize=2)
+    cache.put('firewall', 'address', {'mkey': 'name'})
+    cache.put('firewall', 'policy', {'mkey': 'policyid'})
+    cache.get('firewall', 'address')
+    cache.put('user', 'local', {'mkey': 'name'})
+
+    assert len(cache) == 2
+    assert cache.get('firewall', 'policy') is None
+    assert cache.get('firewall', 'address') == {'mkey': 'name'}
+
+
+def test_schema_cache_shares_entries_between_vdoms():
+    cache = SchemaCache()
+    cache.put('firewall', 'address', {'mkey': 'name'}, vdom='root')
+
+    assert cache.get('firewall', 'address', vdom='customer') == {'mkey': 'name'}
+    assert cache.get('firewall', 'address', vdom='global') is None
+
+
+def test_schema_cache_invalidate():
+    cache = SchemaCache()
+    cache.put('firewall', 'address', {'mkey': 'name'})
+    cache.put('firewall', 'policy', {'mkey': 'policyid'})
+    cache.put('user', 'local', {'mkey': 'name'})
+
+    cache.invalidate('firewall', 'address')
+    assert len(cache) == 2
+    cache.invalidate('firewall')
+    assert len(cache) == 1
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_get_mkeyname_fetches_schema_once(conn):
+    fos = FortiOSHandler(conn)
+
+    assert fos.get_mkeyname('firewall', 'address', vdom='root') == 'name'
+    assert fos.get_mkeyname('firewall', 'address', vdom='root') == 'name'
+
+    conn.send_request.assert_called_once_with(url='/api/v2/cmdb/firewall/address?vdom=root&action=schema')
+    conn.cache_schema.assert_called_once_with('firewall', 'address', {'mkey': 'name', 'mkey_type': 'string'}, vdom='root')
+
+
+def test_get_mkeyname_uses_connection_cache(conn):
+    conn.get_cached_schema.return_value = {'mkey': 'policyid'}
+    fos = FortiOSHandler(conn)
+
+    assert fos.get_mkeyname('firewall', 'policy', vdom='root') == 'policyid'
+    conn.send_request.assert_not_called()
+
+
+def test_invalidate_schema_reaches_connection(conn):
+    fos = FortiOSHandler(conn)
+    fos.get_mkeyname('firewall', 'address', vdom='root')
+    fos.invalidate_schema('firewall', 'address')
+    fos.get_mkeyname('firewall', 'address', vdom='root')
+
+    assert conn.send_request.call_count == 2
+    conn.invalidate_schema_cache.assert_called_once_with(path='firewall', name='address', vdom=None)
+
+
+def test_schema_store_round_trip(tmpdir):
+    store = SchemaStore(str(tmpdir.join('schemas')), 'v6.0.2', 163)
+    assert store.get('firewall', 'address', vdom='root') is None
+    store.put('firewall', 'address', {'mkey': 'name'}, vdom='root')
+
+    reloaded = SchemaStore(str(tmpdir.join('schemas')), 'v6.0.2', 163)
+    assert reloaded.get('firewall', 'address') == {'mkey': 'name'}
+    assert SchemaStore(str(tmpdir.join('schemas')), 'v6.0.2', 164).get('firewall', 'address') is None
+
+
+def test_schema_store_keeps_schemas_saved_by_others(tmpdir):
+    first = SchemaStore(str(tmpdir), 'v6.0.2', 163)
+    second = SchemaStore(str(tmpdir), 'v6.0.2', 163)
+    first.put('firewall', 'address', {'mkey': 'name'})
+    second.put('firewall', 'policy', {'mkey': 'policyid'})
+
+    reloaded = SchemaStore(str(tmpdir), 'v6.0.2', 163)
+    assert reloaded.get('firewall', 'address') == {'mkey': 'name'}
+    assert reloaded.get('firewall', 'policy') == {'mkey': 'policyid'}
+
+
+def test_schema_store_logs_write_failures(mocker, tmpdir):
+    tmpdir.join('schemas').write('not a directory')
+    log = mocker.Mock()
+    store = SchemaStore(str(tmpdir.join('schemas')), 'v6.0.2', 163, log=log)
+
+    store.put('firewall', 'address', {'mkey': 'name'})
+
+    assert store.get('firewall', 'address') == {'mkey': 'name'}
+    assert log.call_args[0][0].startswith('Could not save the schema store')
+
+
+def response(http_method='GET', http_status=200, results=None):
+    resp = {'status': 'success' if http_status == 200 else 'error', 'http_method': http_method, 'http_status': http_status}
+    if results is not None:
+        resp['results'] = results
+    return http_status, json.dumps(resp).encode('utf-8')
+
+
+def test_set_many_reads_table_once(conn):
+    table = [{'name': 'a', 'subnet': '10.0.0.1 255.255.255.255'},
+             {'name': 'b', 'subnet': '10.0.0.1 255.255.255.255'}]
+    conn.send_request.side_effect = [(200, SCHEMA_RESPONSE), response(results=table)]
+    conn.send_requests.return_value = [response('PUT'), response('POST')]
+    fos = FortiOSHandler(conn)
+
+    responses = fos.set_many('firewall', 'address', [{'name': 'a'},
+                                                     {'name': 'b', 'subnet': '10.0.0.2 255.255.255.255'},
+                                                     {'name': 'c'}], vdom='root')
+
+    assert [resp['status'] for resp in responses] == ['success', 'success', 'success']
+    assert responses[0]['revision_changed'] is False
+    assert [resp['http_method'] for resp in responses[1:]] == ['PUT', 'POST']
+    conn.send_request.assert_called_with(url='/api/v2/cmdb/firewall/address?vdom=root',
+                                         params={'start': 0, 'count': 1000, 'format': 'name|subnet'}, method='GET')
+    conn.send_requests.assert_called_once_with([
+        dict(url='/api/v2/cmdb/firewall/address/b?vdom=root', params=None,
+             data=dumps({'name': 'b', 'subnet': '10.0.0.2 255.255.255.255'}), method='PUT'),
+        dict(url='/api/v2/cmdb/firewall/address?vdom=root', params=None,
+             data=dumps({'name': 'c'}), method='POST')])
+    table = fos.get_table('firewall', 'address', vdom='root', fields=['subnet'])
+    assert table['b']['subnet'] == '10.0.0.2 255.255.255.255'
+    assert 'c' in table
+
+
+def test_delete_many_sends_one_batch(conn):
+    conn.send_requests.return_value = [response('DELETE'), response('DELETE', http_status=404)]
+    fos = FortiOSHandler(conn)
+
+    responses = fos.delete_many('firewall', 'address', ['a', 'b'], vdom='root')
+
+    assert [resp['http_status'] for resp in responses] == [200, 404]
+    conn.send_request.assert_not_called()
+    assert [request['url'] for request in conn.send_requests.call_args[0][0]] == \
+        ['/api/v2/cmdb/firewall/address/a?vdom=root', '/api/v2/cmdb/firewall/address/b?vdom=root']
+
+
+def test_set_table_writes_only_the_delta(conn):
+    table = [{'name': 'a', 'subnet': '10.0.0.1 255.255.255.255'},
+             {'name': 'b', 'subnet': '10.0.0.1 255.255.255.255'},
+             {'name': 'old', 'subnet': '10.0.0.9 255.255.255.255'}]
+    conn.send_request.side_effect = [(200, SCHEMA_RESPONSE), response(results=table)]
+    conn.send_requests.side_effect = [[response('POST')], [response('PUT')], [response('DELETE')]]
+    fos = FortiOSHandler(conn)
+
+    responses = fos.set_table('firewall', 'address', [{'name': 'a'},
+                                                      {'name': 'b', 'subnet': '10.0.0.2 255.255.255.255'},
+                                                      {'name': 'c'}], vdom='root')
+
+    assert [resp.get('http_method') for resp in responses] == ['GET', 'PUT', 'POST', 'DELETE']
+    assert responses[0]['revision_changed'] is False
+    assert [[request['method'] for request in call[0][0]] for call in conn.send_requests.call_args_list] == \
+        [['POST'], ['PUT'], ['DELETE']]
+    assert conn.send_requests.call_args[0][0][0]['url'] == '/api/v2/cmdb/firewall/address/old?vdom=root'
+    assert conn.send_request.call_count == 2
+    assert sorted(fos.get_table('firewall', 'address', vdom='root', fields=['name'])) == ['a', 'b', 'c']
+
+
+def test_set_vdoms_writes_each_vdom(conn):
+    conn.send_request.side_effect = [response(results=[{'name': 'root'}, {'name': 'dmz'}]), (200, SCHEMA_RESPONSE)]
+    conn.send_requests.side_effect = [[response(results=[{'name': 'a'}]), response(http_status=404)],
+                                      [response('POST')],
+                                      [response('DELETE'), response('DELETE')]]
+    fos = FortiOSHandler(conn)
+
+    responses = fos.set_vdoms('firewall', 'address', {'name': 'a'}, 'all', mkey='a')
+
+    assert list(responses) == ['root', 'dmz']
+    assert responses['root']['revision_changed'] is False
+    assert responses['dmz']['http_method'] == 'POST'
+    # The objects of every vdom are read in one batch
+    assert conn.send_requests.call_args_list[0][0][0] == [
+        dict(url='/api/v2/cmdb/firewall/address/a?vdom=root', params={'format': 'name'}, method='GET'),
+        dict(url='/api/v2/cmdb/firewall/address/a?vdom=dmz', params={'format': 'name'}, method='GET')]
+    conn.send_requests.assert_called_with([dict(url='/api/v2/cmdb/firewall/address?vdom=dmz', params=None,
+                                                data=dumps({'name': 'a'}), method='POST')])
+
+    responses = fos.delete_vdoms('firewall', 'address', ['root', 'dmz'], mkey='a')
+    assert [resp['http_method'] for resp in responses.values()] == ['DELETE', 'DELETE']
+
+
+def test_set_skips_put_when_config_matches(conn):
+    current = {'name': 'a', 'subnet': '10.0.0.1 255.255.255.255', 'color': 0,
+               'tagging': [{'name': 't1', 'category': '', 'tags': [{'name': 'x', 'q_origin_key': 'x'}]}]}
+    conn.send_request.side_effect = [response(results=[current])]
+    fos = FortiOSHandler(conn)
+
+    resp = fos.set('firewall', 'address', {'name': 'a', 'subnet': '10.0.0.1 255.255.255.255', 'comment': None,
+                                           'tagging': [{'name': 't1', 'tags': [{'name': 'x'}]}]},
+                   mkey='a', vdom='root')
+
+    assert resp['status'] == 'success'
+    assert resp['revision_changed'] is False
+    conn.send_request.assert_called_once_with(url='/api/v2/cmdb/firewall/address/a?vdom=root',
+                                              params={'format': 'name|subnet|tagging'}, method='GET')
+
+
+def test_set_posts_missing_object(conn):
+    conn.send_request.side_effect = [response(http_status=404), (200, SCHEMA_RESPONSE), response('POST')]
+    fos = FortiOSHandler(conn)
+
+    data = {'comment': 'new'}
+    resp = fos.set('firewall', 'address', data, mkey='a', vdom='root')
+
+    assert resp['http_method'] == 'POST'
+    assert data == {'comment': 'new'}
+    conn.send_request.assert_called_with(url='/api/v2/cmdb/firewall/address?vdom=root', params=None,
+                                         data=dumps({'comment': 'new', 'name': 'a'}), method='POST')
+
+
+def test_set_returns_put_error_of_existing_object(conn):
+    conn.send_request.side_effect = [(200, SCHEMA_RESPONSE), response(results=[{'name': 'a', 'comment': 'old'}]),
+                                     response('PUT', http_status=500)]
+    fos = FortiOSHandler(conn)
+
+    resp = fos.set('firewall', 'address', {'name': 'a', 'comment': 'new'}, vdom='root')
+
+    # The object was read, a failed PUT is not retried as a POST
+    assert resp['http_method'] == 'PUT' and resp['http_status'] == 500
+    assert conn.send_request.call_count == 3
+
+
+def test_set_does_not_write_when_read_fails(conn):
+    conn.send_request.side_effect = [(200, SCHEMA_RESPONSE), response(http_status=403)]
+    fos = FortiOSHandler(conn)
+
+    resp = fos.set('firewall', 'address', {'name': 'a', 'comment': 'new'}, vdom='root')
+
+    assert resp['status'] == 'error' and resp['http_status'] == 403
+    assert conn.send_request.call_count == 2
+
+
+def test_set_posts_object_without_key(conn):
+    policy_schema = json.dumps({'results': {'mkey': 'policyid', 'mkey_type': 'integer'}}).encode('utf-8')
+    conn.send_request.side_effect = [(200, policy_schema), response('POST'),
+                                     response(http_status=404), response('POST')]
+    fos = FortiOSHandler(conn)
+
+    # The device assigns the key, there is no object to read first
+    resp = fos.set('firewall', 'policy', {'action': 'accept'}, vdom='root')
+    assert resp['http_method'] == 'POST'
+    conn.send_request.assert_called_with(url='/api/v2/cmdb/firewall/policy?vdom=root', params=None,
+                                         data=dumps({'action': 'accept'}), method='POST')
+
+    resp = fos.set('firewall', 'policy', {'policyid': 0, 'action': 'accept'}, vdom='root')
+    assert resp['http_method'] == 'POST'
+    assert conn.send_request.call_args_list[2][1]['url'] == '/api/v2/cmdb/firewall/policy/0?vdom=root'
+    assert conn.send_request.call_count == 4
+
+
+def test_set_uses_table_listing(conn):
+    conn.send_request.side_effect = [(200, SCHEMA_RESPONSE), response(results=[{'name': 'a'}]),
+                                     response('POST'),
+                                     response(results=[{'name': 'a', 'comment': 'old'}]), response('PUT')]
+    fos = FortiOSHandler(conn)
+
+    assert list(fos.get_table('firewall', 'address', vdom='root', fields=['name'])) == ['a']
+    conn.send_request.assert_called_with(url='/api/v2/cmdb/firewall/address?vdom=root',
+                                         params={'start': 0, 'count': 1000, 'format': 'name'}, method='GET')
+
+    # A key missing from the listing is created without asking for the object first
+    resp = fos.set('firewall', 'address', {'name': 'b', 'comment': 'new'}, vdom='root')
+    assert resp['http_method'] == 'POST'
+    conn.send_request.assert_called_with(url='/api/v2/cmdb/firewall/address?vdom=root', params=None,
+                                         data=dumps({'name': 'b', 'comment': 'new'}), method='POST')
+    assert sorted(fos.get_table('firewall', 'address', vdom='root', fields=['name'])) == ['a', 'b']
+
+    # An existing object is still read to compare the attributes the listing does not hold
+    resp = fos.set('firewall', 'address', {'name': 'a', 'comment': 'new'}, vdom='root')
+    assert resp['http_method'] == 'PUT'
+    assert conn.send_request.call_count == 5
+
+
+def test_check_mode_only_reads(conn):
+    conn.send_request.side_effect = [(200, SCHEMA_RESPONSE),
+                                     response(results=[{'name': 'a', 'comment': 'old'}]),
+                                     response(http_status=404),
+                                     response(results=[{'name': 'a'}, {'name': 'c'}])]
+    fos = FortiOSHandler(conn, check_mode=True)
+
+    with fos.transaction() as transaction:
+        update = fos.set('firewall', 'address', {'name': 'a', 'comment': 'new'}, vdom='root')
+        create = fos.set('firewall', 'address', {'name': 'b', 'comment': 'new'}, vdom='root')
+        deletes = fos.delete_many('firewall', 'address', ['b', 'c', 'd'], vdom='root')
+
+    assert transaction['commit']['status'] == 'success'
+    assert update['http_method'] == 'PUT'
+    assert update['diff']['before'] == {'comment': 'old'} and update['diff']['after'] == {'comment': 'new'}
+    assert create['http_method'] == 'POST' and create['diff']['before'] == {}
+    assert [resp['http_status'] for resp in deletes] == [404, 200, 404]
+    assert deletes[1]['diff']['before'] == {'name': 'c'}
+    assert all(call[1].get('method', 'GET') == 'GET' for call in conn.send_request.call_args_list)
+    conn.send_requests.assert_not_called()
+
+    with pytest.raises(Exception):
+        fos._send(url='/api/v2/cmdb/firewall/address', method='POST')
+
+
+def test_get_tables_reads_pages_together(conn):
+    conn.send_requests.side_effect = [
+        [response(results=[{'policyid': 1}, {'policyid': 2}]), response(results={'hostname': 'FGVM'})],
+        [response(results=[{'policyid': 3}])]]
+    fos = FortiOSHandler(conn)
+
+    responses = fos.get_tables([('firewall', 'policy'), ('system', 'global')], vdom='root', page_size=2)
+
+    assert responses[('firewall', 'policy')]['results'] == [{'policyid': 1}, {'policyid': 2}, {'policyid': 3}]
+    assert responses[('system', 'global')]['results'] == {'hostname': 'FGVM'}
+    assert [request['params'] for request in conn.send_requests.call_args[0][0]] == [{'start': 2, 'count': 2}]
+    conn.send_request.assert_not_called()
+
+
+def test_plan_moves_keeps_longest_ordered_run():
+    current = ['1', '2', '3', '4', '5', '6']
+
+    assert plan_moves(current, ['1', '2', '3']) == []
+    assert plan_moves(current, ['6', '1', '2', '3', '4', '5']) == [('6', 'before', '1')]
+    assert plan_moves(current, ['2', '1', '3', '5', '4', '6']) == [('1', 'after', '2'), ('4', 'after', '5')]
+    assert plan_moves(current, ['6', '4', '2']) == [('4', 'after', '6'), ('2', 'after', '4')]
+
+
+def test_move_sends_one_put(conn):
+    conn.send_request.return_value = response('PUT')
+    fos = FortiOSHandler(conn)
+
+    fos.move('firewall', 'policy', vdom='root', mkey='6', where='before', reference_key=1)
+
+    conn.send_request.assert_called_once_with(url='/api/v2/cmdb/firewall/policy/6?vdom=root',
+                                              params={'action': 'move', 'before': '1'}, method='PUT')
+
+
+def test_config_diff():
+    current = {'name': 'a', 'member': [{'name': 'x'}, {'name': 'y'}], 'color': 3}
+
+    assert config_diff({'name': 'a', 'color': 3, 'comment': None}, current) == {}
+    assert config_diff({'name': 'a', 'member': [{'name': 'x'}]}, current) == {'member': [{'name': 'x'}]}
+    assert config_diff({'color': 4}, None) == {'color': 4}
+
+
+def test_get_pages_reads_until_short_page(conn):
+    conn.send_request.side_effect = [response(results=[{'name': 'a'}, {'name': 'b'}]),
+                                     response(results=[{'name': 'c'}])]
+    fos = FortiOSHandler(conn)
+
+    pages = fos.get_pages('firewall', 'address', vdom='root', page_size=2)
+    assert [entry['name'] for entry in next(pages)['results']] == ['a', 'b']
+    conn.send_request.assert_called_once_with(url='/api/v2/cmdb/firewall/address?vdom=root',
+                                              params={'start': 0, 'count': 2}, method='GET')
+    assert [entry['name'] for entry in next(pages)['results']] == ['c']
+    conn.send_request.assert_called_with(url='/api/v2/cmdb/firewall/address?vdom=root',
+                                         params={'start': 2, 'count': 2}, method='GET')
+    assert list(pages) == []
+
+
+def test_get_table_projection(conn):
+    conn.send_request.side_effect = [(200, SCHEMA_RESPONSE),
+                                     response(results=[{'name': 'a', 'type': 'ipmask'}]),
+                                     response(results=[{'name': 'a', 'type': 'ipmask', 'subnet': '10.0.0.1 255.255.255.255'}])]
+    fos = FortiOSHandler(conn)
+
+    assert fos.get_table('firewall', 'address', fields=['type']) == {'a': {'name': 'a', 'type': 'ipmask'}}
+    conn.send_request.assert_called_with(url='/api/v2/cmdb/firewall/address',
+                                         params={'start': 0, 'count': 1000, 'format': 'name|type'}, method='GET')
+    fos.get_table('firewall', 'address', fields=['name'])
+    assert conn.send_request.call_count == 2
+
+    assert fos.get_table('firewall', 'address')['a']['subnet'] == '10.0.0.1 255.255.255.255'
+    fos.get_table('firewall', 'address', fields=['subnet'])
+    assert conn.send_request.call_count == 3
+
+
+def test_transaction_commits_writes(conn):
+    conn.send_request.side_effect = [response('POST', results={'transaction-id': 7}),
+                                     response('DELETE'),
+                                     response('POST')]
+    fos = FortiOSHandler(conn)
+
+    with fos.transaction() as transaction:
+        fos.delete('firewall', 'address', mkey='a', vdom='root')
+
+    assert transaction['commit']['status'] == 'success'
+    conn.send_request.assert_any_call(url='/api/v2/cmdb/firewall/address/a?vdom=root', params=None,
+                                      data=dumps(None), method='DELETE', headers={'X-TRANSACTION-ID': '7'})
+    conn.send_request.assert_called_with(url='/api/v2/cmdb?action=transaction-commit', method='POST',
+                                         headers={'X-TRANSACTION-ID': '7'})
+
+
+def test_transaction_aborts_on_failed_write(conn):
+    conn.send_request.side_effect = [response('POST', results={'transaction-id': 7}),
+                                     response('DELETE', http_status=500),
+                                     response('POST'),
+                                     response('DELETE')]
+    fos = FortiOSHandler(conn)
+
+    with fos.transaction() as transaction:
+        fos.delete('firewall', 'address', mkey='a', vdom='root')
+    fos.delete('firewall', 'address', mkey='b', vdom='root')
+
+    assert 'commit' not in transaction
+    assert transaction['abort']['status'] == 'success'
+    conn.send_request.assert_called_with(url='/api/v2/cmdb/firewall/address/b?vdom=root', params=None,
+                                         data=dumps(None), method='DELETE')
+
+
+class FakeFortiOSAPI(object):
+
+    def __init__(self, requests):
+        self._session = requests.session()
+        self._logged = False
+        self.host = None
+        self.url_prefix = None
+        self.timeout = None
+
+    def login(self):
+        self.host = '192.168.122.40'
+        self.url_prefix = 'https://192.168.122.40'
+        self.timeout = 12
+        self._session.cookies.set('APSCOOKIE_123', 'session', domain='192.168.122.40', path='/')
+        self._session.cookies.set('ccsrftoken', '"token"', domain='192.168.122.40', path='/')
+        self.update_cookie()
+        self._logged = True
+
+    def update_cookie(self):
+        for cookie in self._session.cookies:
+            if cookie.name == 'ccsrftoken':
+                self._session.headers.update({'X-CSRFTOKEN': cookie.value[1:-1]})
+
+
+def test_fortiosapi_session_is_reused(mocker, tmpdir):
+    requests = pytest.importorskip('requests')
+    first = FakeFortiOSAPI(requests)
+    login = mocker.Mock(side_effect=first.login)
+    session = FortiOSAPISession(first, login, '192.168.122.40', 'admin', directory=str(tmpdir))
+    session.open()
+    session.close()
+    assert login.call_count == 1
+    assert oct(os.stat(session.filename).st_mode & 0o777) == oct(0o600)
+
+    second = FakeFortiOSAPI(requests)
+    relogin = mocker.Mock()
+    FortiOSAPISession(second, relogin, '192.168.122.40', 'admin', directory=str(tmpdir)).open()
+    relogin.assert_not_called()
+    assert second._logged
+    assert second.url_prefix == 'https://192.168.122.40'
+    assert second._session.headers['X-CSRFTOKEN'] == 'token'
+    assert second._session.cookies.get('APSCOOKIE_123') == 'session'
+
+
+def test_fortiosapi_session_ignores_foreign_directory(mocker, tmpdir):
+    requests = pytest.importorskip('requests')
+    directory = tmpdir.mkdir('shared')
+    directory.chmod(0o777)
+    fos = FakeFortiOSAPI(requests)
+    login = mocker.Mock(side_effect=fos.login)
+    session = FortiOSAPISession(fos, login, '192.168.122.40', 'admin', directory=str(directory))
+
+    # A directory other users can write to may hold planted sessions or links
+    session.open()
+    session.close()
+    assert login.call_count == 1
+    assert directory.listdir() == []
+
+
+def test_fortiosapi_session_logs_in_again_on_401(mocker, tmpdir):
+    requests = pytest.importorskip('requests')
+    fos = FakeFortiOSAPI(requests)
+    login = mocker.Mock(side_effect=fos.login)
+    session = FortiOSAPISession(fos, login, '192.168.122.40', 'admin', directory=str(tmpdir))
+    session.open()
+
+    expired = requests.Response()
+    expired.status_code = 401
+    expired.request = requests.Request('GET', 'https://192.168.122.40/api/v2/cmdb/user/device').prepare()
+    retried = requests.Response()
+    send = mocker.patch.object(fos._session, 'send', return_value=retried)
+
+    assert fos._session.hooks['response'][-1](expired) is retried
+    assert login.call_count == 2
+    assert send.call_args[0][0].headers['X-CSRFTOKEN'] == 'token'
+    assert 'APSCOOKIE_123=session' in send.call_args[0][0].headers['Cookie']
+
+
+def test_fortiosapi_session_resends_once(mocker, tmpdir):
+    requests = pytest.importorskip('requests')
+    fos = FakeFortiOSAPI(requests)
+    login = mocker.Mock(side_effect=fos.login)
+    session = FortiOSAPISession(fos, login, '192.168.122.40', 'admin', directory=str(tmpdir))
+    session.open()
+    hook = fos._session.hooks['response'][-1]
+
+    def unauthorized():
+        res = requests.Response()
+        res.status_code = 401
+        res.request = requests.Request('GET', 'https://192.168.122.40/api/v2/cmdb/user/device').prepare()
+        return res
+
+    # Like requests, the resent request goes through the response hooks again
+    send = mocker.patch.object(fos._session, 'send', side_effect=lambda request, **kwargs: hook(unauthorized()))
+
+    assert hook(unauthorized()).status_code == 401
+    assert send.call_count == 1
+    assert login.call_count == 2
+
+
+def test_direct_connection_login(mocker):
+    cookie = mocker.Mock()
+    cookie.name = 'ccsrftoken'
+    cookie.value = '"ABC"'
+    open_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.Request.open')
+    open_mock.return_value.getcode.return_value = 200
+    open_mock.return_value.read.return_value = b'1document.location="/prompt";'
+
+    conn = FortiOSDirectConnection('192.168.122.40', username='admin', password='secret')
+    conn._request.cookies = [cookie]
+    conn.login()
+
+    assert conn._request.headers['X-CSRFTOKEN'] == 'ABC'
+    assert open_mock.call_args[0][:2] == ('POST', 'https://192.168.122.40/logincheck')
+
+    conn.send_request(url='/api/v2/cmdb/firewall/address', params={'vdom': 'root'})
+    assert open_mock.call_args[0][:2] == ('GET', 'https://192.168.122.40/api/v2/cmdb/firewall/address?vdom=root')
@@ -0,0 +1,54 @@
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <https://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import pytest
+
+from ansible.module_utils.network.fortios.runtime import compile_options, direct_connection, load_options
+
+
+def test_compiled_options_round_trip():
+    options = {
+        "name": {"required": True, "type": "str"},
+        "comment": {"required": False, "type": "str"},
+        "member": {"required": False, "type": "list",
+                   "options": {
+                       "name": {"required": False, "type": "str"}
+                   }}
+    }
+
+    assert load_options(compile_options(options)) == {
+        "name": {"required": True, "type": "str"},
+        "comment": {"type": "str"},
+        "member": {"type": "list", "options": {"name": {"type": "str"}}}
+    }
+
+
+def test_direct_connection_fails_module_and_logs_out(mocker):
+    connection_class_mock = mocker.patch('ansible.module_utils.network.fortios.runtime.FortiOSDirectConnection')
+    module = mocker.Mock(params={'host': '192.168.122.40', 'username': 'admin', 'password': '', 'https': True})
+    module.fail_json.side_effect = SystemExit
+
+    with pytest.raises(SystemExit):
+        with direct_connection(module, max_in_flight=8) as connection:
+            raise ValueError('unreachable')
+
+    connection_class_mock.assert_called_once_with('192.168.122.40', username='admin', password='', https=True,
+                                                  max_in_flight=8)
+    module.fail_json.assert_called_once_with(msg='unreachable')
+    connection.logout.assert_called_once_with()
@@ -0,0 +1,95 @@
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <https://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import pytest
+from collections import OrderedDict
+from ansible.module_utils.network.fortios.fortios import FortiOSHandler
+
+try:
+    from ansible.modules.network.fortios import fortios_facts
+except ImportError:
+    pytest.skip("Could not load required modules for testing", allow_module_level=True)
+
+
+@pytest.fixture(autouse=True)
+def connection_mock(mocker):
+    connection_class_mock = mocker.patch('ansible.modules.network.fortios.fortios_facts.Connection')
+    return connection_class_mock
+
+
+fos_instance = FortiOSHandler(connection_mock)
+
+
+def test_facts_expand_wildcards(mocker):
+    table_names_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.get_table_names',
+                                    return_value=[('firewall', 'address'), ('firewall', 'addrgrp'),
+                                                  ('firewall', 'policy'), ('router', 'static')])
+    get_tables_result = OrderedDict([
+        (('firewall', 'policy'), {'status': 'success', 'results': [{'policyid': 1}]}),
+        (('firewall', 'address'), {'status': 'success', 'results': [{'name': 'all'}]}),
+        (('firewall', 'addrgrp'), {'status': 'success', 'results': []}),
+    ])
+    get_tables_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.get_tables',
+                                   return_value=get_tables_result)
+
+    input_data = {'tables': ['firewall/policy', 'firewall/addr*', 'firewall/policy'], 'vdom': 'root'}
+
+    is_error, facts = fortios_facts.fortios_facts(input_data, fos_instance)
+
+    table_names_mock.assert_called_once_with(vdom='root')
+    get_tables_mock.assert_called_once_with([('firewall', 'policy'), ('firewall', 'address'), ('firewall', 'addrgrp')],
+                                            vdom='root')
+    assert not is_error
+    assert facts['fortios_cmdb'] == {'firewall': {'policy': [{'policyid': 1}], 'address': [{'name': 'all'}],
+                                                  'addrgrp': []}}
+
+
+def test_facts_report_unreadable_tables(mocker):
+    mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.get_tables', return_value=OrderedDict([
+        (('firewall', 'nothing'), {'status': 'error', 'http_status': 404})]))
+
+    is_error, result = fortios_facts.fortios_facts({'tables': ['firewall/nothing'], 'vdom': 'root'}, fos_instance)
+
+    assert is_error
+    assert result['msg'] == 'Could not read firewall/nothing'
+
+
+def test_facts_main_login_fails(mocker, capsys):
+    connection_class_mock = mocker.patch('ansible.module_utils.network.fortios.runtime.FortiOSDirectConnection')
+    connection_class_mock.return_value.login.side_effect = Exception('Wrong credentials. Please check')
+    mocker.patch('ansible.module_utils.basic._ANSIBLE_ARGS', json.dumps({'ANSIBLE_MODULE_ARGS': {
+        'host': '192.168.122.40', 'username': 'admin', 'password': 'bad', 'tables': ['firewall/policy']}}).encode('utf-8'))
+
+    with pytest.raises(SystemExit):
+        fortios_facts.main()
+
+    result = json.loads(capsys.readouterr()[0])
+    assert result['failed'] and result['msg'] == "Could not log in: Wrong credentials. Please check"
+
+
+def test_facts_fail_when_tables_cannot_be_listed(mocker):
+    mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.get_table_names', return_value=None)
+    get_tables_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.get_tables')
+
+    is_error, result = fortios_facts.fortios_facts({'tables': ['firewall/*'], 'vdom': 'root'}, fos_instance)
+
+    get_tables_mock.assert_not_called()
+    assert is_error
+    assert result['msg'] == 'Could not list the tables to match firewall/*'
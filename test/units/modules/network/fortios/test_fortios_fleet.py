@@ -0,0 +1,102 @@
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <https://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import pytest
+
+try:
+    from ansible.modules.network.fortios import fortios_fleet
+except ImportError:
+    pytest.skip("Could not load required modules for testing", allow_module_level=True)
+
+
+def fleet_params(hosts, **kwargs):
+    params = {
+        'devices': [{'host': host, 'username': None, 'password': None, 'access_token': None,
+                     'https': None, 'ssl_verify': None} for host in hosts],
+        'username': 'admin',
+        'password': '',
+        'access_token': None,
+        'https': True,
+        'ssl_verify': False,
+        'timeout': 60,
+        'forks': 4,
+        'max_fail_percentage': 0,
+        'transaction': False,
+        'changes': [
+            {'path': 'firewall', 'name': 'address', 'data': {'name': 'srv', 'subnet': '10.0.0.10 255.255.255.255'},
+             'mkey': None, 'vdom': 'root', 'state': 'present'},
+            {'path': 'firewall', 'name': 'addrgrp', 'data': {'name': 'servers', 'member': [{'name': 'srv'}]},
+             'mkey': None, 'vdom': 'root', 'state': 'present'},
+        ]}
+    params.update(kwargs)
+    return params
+
+
+def test_fleet_applies_changes_to_every_device(mocker):
+    connection_mock = mocker.patch('ansible.modules.network.fortios.fortios_fleet.FortiOSDirectConnection')
+    set_method_result = {'status': 'success', 'http_method': 'PUT', 'http_status': 200}
+    set_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set',
+                                   return_value=set_method_result)
+    log = mocker.Mock()
+
+    results, summary = fortios_fleet.fortios_fleet(fleet_params(['10.0.0.1', '10.0.0.2', '10.0.0.3']), log=log)
+
+    assert [result['host'] for result in results] == ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    assert all(result['changed'] and not result['failed'] for result in results)
+    assert set_method_mock.call_count == 6
+    datas = [call[1]['data'] for call in set_method_mock.call_args_list]
+    assert len(set(id(data) for data in datas)) == 6
+    assert connection_mock.return_value.logout.call_count == 3
+    connection_mock.assert_any_call('10.0.0.2', username='admin', password='', access_token=None,
+                                    https=True, ssl_verify=False, timeout=60)
+    assert summary['total'] == 3 and summary['changed'] == 3 and summary['failed'] == 0
+    log.assert_called_with('fortios_fleet: 3/3 devices done, 0 failed')
+
+
+def test_fleet_collects_device_failures(mocker):
+    connection_mock = mocker.patch('ansible.modules.network.fortios.fortios_fleet.FortiOSDirectConnection')
+    connection_mock.return_value.login.side_effect = [None, Exception('timed out')]
+    set_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set', side_effect=[
+        {'status': 'error', 'http_method': 'POST', 'http_status': 500}])
+
+    results, summary = fortios_fleet.fortios_fleet(fleet_params(['10.0.0.1', '10.0.0.2'], forks=1))
+
+    # The group is not changed on the device where adding the address failed
+    assert set_method_mock.call_count == 1
+    assert results[0]['failed'] and len(results[0]['responses']) == 1
+    assert results[1]['failed'] and 'timed out' in results[1]['msg']
+    assert summary['failed'] == 2 and summary['ok'] == 0
+
+
+def test_fleet_options_error():
+    assert fortios_fleet.options_error(fleet_params(['10.0.0.1'])) is None
+
+    params = fleet_params(['10.0.0.1'])
+    params['changes'][1]['data'] = None
+    assert fortios_fleet.options_error(params) == "changes[1]: data is required with state present"
+
+    params = fleet_params(['10.0.0.1'])
+    params['changes'][0].update(state='absent', data=None)
+    assert fortios_fleet.options_error(params) == "changes[0]: mkey or data is required with state absent"
+    params['changes'][0]['mkey'] = 'srv'
+    assert fortios_fleet.options_error(params) is None
+
+    params = fleet_params(['10.0.0.1', '10.0.0.2'], username=None)
+    params['devices'][0]['access_token'] = 'key'
+    assert fortios_fleet.options_error(params) == "10.0.0.2: username or access_token is required"
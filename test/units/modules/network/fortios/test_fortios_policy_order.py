@@ -0,0 +1,94 @@
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <https://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import pytest
+from ansible.module_utils.network.fortios.fortios import FortiOSHandler
+
+try:
+    from ansible.modules.network.fortios import fortios_policy_order
+except ImportError:
+    pytest.skip("Could not load required modules for testing", allow_module_level=True)
+
+
+@pytest.fixture(autouse=True)
+def connection_mock(mocker):
+    connection_class_mock = mocker.patch('ansible.modules.network.fortios.fortios_policy_order.Connection')
+    return connection_class_mock
+
+
+fos_instance = FortiOSHandler(connection_mock)
+
+
+def test_policy_order_moves_out_of_place_policies(mocker):
+    mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.get_order',
+                 return_value=['1', '2', '3', '4', '5'])
+    move_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.move',
+                                    return_value={'status': 'success', 'http_method': 'PUT', 'http_status': 200})
+
+    input_data = {'path': 'firewall', 'name': 'policy', 'vdom': 'root', 'sequence': [5, 1, 2, 3, 4]}
+
+    is_error, changed, result = fortios_policy_order.fortios_policy_order(input_data, fos_instance)
+
+    move_method_mock.assert_called_once_with('firewall', 'policy', vdom='root', mkey='5',
+                                             where='before', reference_key='1')
+    assert not is_error
+    assert changed
+    assert result['moves'] == [{'mkey': '5', 'where': 'before', 'reference_key': '1'}]
+
+
+def test_policy_order_unchanged(mocker):
+    mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.get_order',
+                 return_value=['1', '2', '3'])
+    move_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.move')
+
+    input_data = {'path': 'firewall', 'name': 'policy', 'vdom': 'root', 'sequence': ['1', '3']}
+
+    is_error, changed, result = fortios_policy_order.fortios_policy_order(input_data, fos_instance)
+
+    move_method_mock.assert_not_called()
+    assert not is_error
+    assert not changed
+
+
+def test_policy_order_missing_policy(mocker):
+    mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.get_order',
+                 return_value=['1', '2'])
+    move_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.move')
+
+    input_data = {'path': 'firewall', 'name': 'policy', 'vdom': 'root', 'sequence': ['2', '9']}
+
+    is_error, changed, result = fortios_policy_order.fortios_policy_order(input_data, fos_instance)
+
+    move_method_mock.assert_not_called()
+    assert is_error
+    assert result['msg'] == "No such policies: 9"
+
+
+def test_policy_order_main_login_fails(mocker, capsys):
+    connection_class_mock = mocker.patch('ansible.module_utils.network.fortios.runtime.FortiOSDirectConnection')
+    connection_class_mock.return_value.login.side_effect = Exception('Wrong credentials. Please check')
+    mocker.patch('ansible.module_utils.basic._ANSIBLE_ARGS', json.dumps({'ANSIBLE_MODULE_ARGS': {
+        'host': '192.168.122.40', 'username': 'admin', 'password': 'bad', 'sequence': [1]}}).encode('utf-8'))
+
+    with pytest.raises(SystemExit):
+        fortios_policy_order.main()
+
+    result = json.loads(capsys.readouterr()[0])
+    assert result['failed'] and result['msg'] == "Could not log in: Wrong credentials. Please check"
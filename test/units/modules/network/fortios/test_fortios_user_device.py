@@ -20,6 +20,7 @@ __metaclass__ = type
 import os
 import json
 import pytest
+from ansible.module_utils.network.fortios import runtime
 from ansible.module_utils.network.fortios.fortios import FortiOSHandler
 
 try:
@@ -319,3 +320,223 @@ def test_user_device_filter_foreign_attributes(mocker):
     assert changed
     assert response['status'] == 'success'
     assert response['http_status'] == 200
+
+
+def test_user_device_objects_creation(mocker):
+    schema_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.schema')
+
+    set_many_method_result = [{'status': 'success', 'http_method': 'PUT', 'http_status': 200},
+                              {'status': 'error', 'http_method': 'POST', 'http_status': 500}]
+    set_many_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set_many',
+                                        return_value=set_many_method_result)
+
+    input_data = {
+        'username': 'admin',
+        'state': 'present',
+        'user_device': None,
+        'objects': [
+            {'alias': 'myuser', 'master_device': 'master', 'avatar': None},
+            {'alias': 'otheruser', 'mac': '00:01:04:03:ab:c3:33'}
+        ],
+        'vdom': 'root'}
+
+    is_error, changed, response = fortios_user_device.fortios_user(input_data, fos_instance)
+
+    expected_objects = [
+        {'alias': 'myuser', 'master-device': 'master'},
+        {'alias': 'otheruser', 'mac': '00:01:04:03:ab:c3:33'}
+    ]
+
+    set_many_method_mock.assert_called_with('user', 'device', expected_objects, vdom='root')
+    schema_method_mock.assert_not_called()
+    assert is_error
+    assert changed
+    assert response == set_many_method_result
+
+
+def test_user_device_objects_removal(mocker):
+    delete_many_method_result = [{'status': 'success', 'http_method': 'DELETE', 'http_status': 200},
+                                 {'status': 'error', 'http_method': 'DELETE', 'http_status': 404}]
+    delete_many_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.delete_many',
+                                           return_value=delete_many_method_result)
+
+    input_data = {
+        'username': 'admin',
+        'state': 'absent',
+        'user_device': None,
+        'objects': [{'alias': 'myuser'}, {'alias': 'otheruser'}],
+        'vdom': 'root'}
+
+    is_error, changed, response = fortios_user_device.fortios_user(input_data, fos_instance)
+
+    delete_many_method_mock.assert_called_with('user', 'device', ['myuser', 'otheruser'], vdom='root')
+    assert not is_error
+    assert changed
+
+
+def test_user_device_objects_overridden(mocker):
+    set_table_method_result = [{'status': 'success', 'http_method': 'GET', 'http_status': 200, 'revision_changed': False},
+                               {'status': 'success', 'http_method': 'DELETE', 'http_status': 200}]
+    set_table_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set_table',
+                                         return_value=set_table_method_result)
+
+    input_data = {
+        'username': 'admin',
+        'state': 'overridden',
+        'user_device': None,
+        'objects': [{'alias': 'myuser', 'mac': '00:01:04:03:ab:c3:32'}],
+        'vdom': 'root'}
+
+    is_error, changed, response = fortios_user_device.fortios_user(input_data, fos_instance)
+
+    set_table_method_mock.assert_called_with('user', 'device', [{'alias': 'myuser', 'mac': '00:01:04:03:ab:c3:32'}], vdom='root')
+    assert not is_error
+    assert changed
+    assert response == set_table_method_result
+
+
+def test_user_device_unchanged(mocker):
+    set_method_result = {'status': 'success', 'http_method': 'GET', 'http_status': 200, 'revision_changed': False}
+    set_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set', return_value=set_method_result)
+
+    input_data = {
+        'username': 'admin',
+        'state': 'present',
+        'user_device': {
+            'alias': 'myuser',
+            'mac': '00:01:04:03:ab:c3:32'
+        },
+        'vdom': 'root'}
+
+    is_error, changed, response = fortios_user_device.fortios_user(input_data, fos_instance)
+
+    set_method_mock.assert_called_with('user', 'device', data={'alias': 'myuser', 'mac': '00:01:04:03:ab:c3:32'}, vdom='root')
+    assert not is_error
+    assert not changed
+
+
+def test_user_device_transaction_aborted(mocker):
+    mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.start_transaction',
+                 return_value={'status': 'success', 'http_method': 'POST', 'http_status': 200})
+    abort_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.abort_transaction',
+                                     return_value={'status': 'success', 'http_method': 'POST', 'http_status': 200})
+    set_method_result = {'status': 'error', 'http_method': 'POST', 'http_status': 500}
+    mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set', return_value=set_method_result)
+
+    input_data = {
+        'username': 'admin',
+        'state': 'present',
+        'transaction': True,
+        'user_device': {'alias': 'myuser'},
+        'vdom': 'root'}
+
+    fos = FortiOSHandler(connection_mock)
+    fos._transaction_failed = True
+    is_error, changed, response = fortios_user_device.fortios_user_in_transaction(input_data, fos)
+
+    abort_method_mock.assert_called_once_with()
+    assert is_error
+    assert not changed
+    assert response['responses'] == set_method_result
+
+
+def test_user_device_vdoms(mocker):
+    set_vdoms_method_result = {'root': {'status': 'success', 'http_method': 'PUT', 'http_status': 200},
+                               'dmz': {'status': 'success', 'http_method': 'PUT', 'http_status': 200,
+                                       'revision_changed': False}}
+    set_vdoms_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set_vdoms',
+                                         return_value=set_vdoms_method_result)
+
+    input_data = {
+        'username': 'admin',
+        'state': 'present',
+        'user_device': {'alias': 'myuser', 'master_device': 'master'},
+        'objects': None,
+        'vdom': ['root', 'dmz']}
+
+    is_error, changed, response = fortios_user_device.fortios_user(input_data, fos_instance)
+
+    set_vdoms_method_mock.assert_called_with('user', 'device', data={'alias': 'myuser', 'master-device': 'master'},
+                                             vdoms=['root', 'dmz'])
+    assert not is_error
+    assert changed
+    assert response == set_vdoms_method_result
+
+
+def test_user_device_all_vdoms_unreadable(mocker):
+    get_method_result = {'status': 'error', 'http_method': 'GET', 'http_status': 403}
+    mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.get', return_value=get_method_result)
+    set_vdoms_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set_vdoms')
+
+    input_data = {
+        'username': 'admin',
+        'state': 'present',
+        'user_device': {'alias': 'myuser'},
+        'objects': None,
+        'vdom': 'all'}
+
+    is_error, changed, response = fortios_user_device.fortios_user(input_data, fos_instance)
+
+    set_vdoms_method_mock.assert_not_called()
+    assert is_error
+    assert not changed
+    assert response == get_method_result
+
+
+def test_user_device_main_runs_module(mocker, connection_mock, capsys):
+    set_method_result = {'status': 'success', 'http_method': 'PUT', 'http_status': 200}
+    set_method_mock = mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set',
+                                   return_value=set_method_result)
+    mocker.patch('ansible.module_utils.basic._ANSIBLE_ARGS', json.dumps({'ANSIBLE_MODULE_ARGS': {
+        '_ansible_socket': '/tmp/socket', 'state': 'present',
+        'user_device': {'alias': 'myuser', 'comment': 'Comment.'}}}).encode('utf-8'))
+
+    with pytest.raises(SystemExit):
+        fortios_user_device.main()
+
+    connection_mock.assert_called_once_with('/tmp/socket')
+    set_method_mock.assert_called_once_with('user', 'device', data={'alias': 'myuser', 'comment': 'Comment.'}, vdom='root')
+    result = json.loads(capsys.readouterr()[0])
+    assert result['changed'] and result['meta'] == set_method_result
+
+
+def test_user_device_main_check_mode(mocker, connection_mock, capsys):
+    diff = {'before': {}, 'after': {'alias': 'myuser'}}
+    set_method_result = {'status': 'success', 'http_method': 'POST', 'http_status': 200, 'diff': diff}
+    mocker.patch('ansible.module_utils.network.fortios.fortios.FortiOSHandler.set', return_value=set_method_result)
+    handler_mock = mocker.spy(runtime, 'FortiOSHandler')
+    mocker.patch('ansible.module_utils.basic._ANSIBLE_ARGS', json.dumps({'ANSIBLE_MODULE_ARGS': {
+        '_ansible_socket': '/tmp/socket', '_ansible_check_mode': True, 'state': 'present',
+        'user_device': {'alias': 'myuser'}}}).encode('utf-8'))
+
+    with pytest.raises(SystemExit):
+        fortios_user_device.main()
+
+    assert handler_mock.call_args[1] == {'check_mode': True}
+    result = json.loads(capsys.readouterr()[0])
+    assert result['changed'] and result['diff'] == [diff]
+
+
+def test_user_device_main_check_mode_login_fails(mocker, capsys):
+    connection_class_mock = mocker.patch('ansible.module_utils.network.fortios.runtime.FortiOSDirectConnection')
+    connection_class_mock.return_value.login.side_effect = Exception('Wrong credentials. Please check')
+    mocker.patch('ansible.module_utils.basic._ANSIBLE_ARGS', json.dumps({'ANSIBLE_MODULE_ARGS': {
+        '_ansible_check_mode': True, 'host': '192.168.122.40', 'username': 'admin', 'password': 'bad',
+        'state': 'present', 'user_device': {'alias': 'myuser'}}}).encode('utf-8'))
+
+    with pytest.raises(SystemExit):
+        fortios_user_device.main()
+
+    result = json.loads(capsys.readouterr()[0])
+    assert result['failed'] and result['msg'] == "Could not log in: Wrong credentials. Please check"
+
+
+def test_user_device_main_requires_an_object(mocker, connection_mock, capsys):
+    mocker.patch('ansible.module_utils.basic._ANSIBLE_ARGS', json.dumps({'ANSIBLE_MODULE_ARGS': {
+        '_ansible_socket': '/tmp/socket', 'state': 'present'}}).encode('utf-8'))
+
+    with pytest.raises(SystemExit):
+        fortios_user_device.main()
+
+    result = json.loads(capsys.readouterr()[0])
+    assert result['failed'] and 'one of the following is required' in result['msg']
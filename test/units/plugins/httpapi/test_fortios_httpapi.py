@@ -0,0 +1,270 @@
+# Copyright 2019 Fortinet, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <https://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import gzip
+import json
+import threading
+import time
+import pytest
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from ansible.plugins.httpapi.fortios import AdaptiveLimiter, HttpApi, KeepAlivePool
+
+
+STATUS_RESPONSE = json.dumps({'results': {'hostname': 'FGVM'}, 'status': 'success',
+                              'version': 'v6.0.2', 'build': 163, 'serial': 'FGVMEVYYQT3AB5352'})
+
+
+@pytest.fixture
+def plugin(mocker):
+    plugin = HttpApi(mocker.Mock())
+    plugin._options = {'access_token': None, 'keep_alive': False, 'max_in_flight': 4, 'latency_target': 2.0,
+                       'retries': 3, 'retry_backoff': 0.5, 'request_compression_min_size': 0,
+                       'schema_cache_size': 2, 'schema_store_path': None}
+    plugin._ccsrftoken = 'token'
+    return plugin
+
+
+def test_schema_cache_lives_on_connection(plugin):
+    plugin.cache_schema('firewall', 'address', {'mkey': 'name'}, vdom='root')
+
+    assert plugin.get_cached_schema('firewall', 'address', vdom='root') == {'mkey': 'name'}
+    plugin.invalidate_schema_cache(path='firewall')
+    assert plugin.get_cached_schema('firewall', 'address', vdom='root') is None
+
+
+def test_schema_store_is_read_before_device(plugin, mocker, tmpdir):
+    plugin._options['schema_store_path'] = str(tmpdir)
+    send_request = mocker.patch.object(plugin, 'send_request', return_value=(200, STATUS_RESPONSE))
+    plugin.cache_schema('firewall', 'address', {'mkey': 'name'}, vdom='root')
+    assert tmpdir.join('fortios_v6.0.2_build163.json.gz').check()
+
+    other = HttpApi(mocker.Mock())
+    other._options = dict(plugin._options)
+    mocker.patch.object(other, 'send_request', return_value=(200, STATUS_RESPONSE))
+    assert other.get_cached_schema('firewall', 'address', vdom='customer') == {'mkey': 'name'}
+    send_request.assert_called_once_with(url='/api/v2/monitor/system/status')
+
+
+def test_send_request_encodes_params(plugin, mocker):
+    response = mocker.Mock(status=200)
+    response_data = mocker.Mock()
+    response_data.getvalue.return_value = b'{}'
+    plugin._connection.send.return_value = (response, response_data)
+
+    plugin.send_request(url='/api/v2/cmdb/firewall/address?vdom=root', params={'start': 0, 'count': 1000})
+
+    plugin._connection.send.assert_called_once_with('/api/v2/cmdb/firewall/address?vdom=root&start=0&count=1000', '',
+                                                    headers=mocker.ANY, method='GET')
+
+
+def test_access_token_skips_login(plugin, mocker):
+    plugin._options['access_token'] = 'secret'
+    plugin._ccsrftoken = ''
+    plugin._connection._auth = None
+    response = mocker.Mock(status=200)
+    response_data = mocker.Mock()
+    response_data.getvalue.return_value = b'{}'
+    plugin._connection.send.return_value = (response, response_data)
+
+    plugin.login('admin', '')
+    assert plugin._connection._auth == {'Authorization': 'Bearer secret'}
+    plugin.send_request(url='/api/v2/cmdb/firewall/address?vdom=root')
+    plugin.logout()
+
+    plugin._connection.send.assert_called_once_with('/api/v2/cmdb/firewall/address?vdom=root', '',
+                                                    headers={'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'}, method='GET')
+    assert plugin.update_auth(response, response_data) is None
+    response.getheaders.assert_not_called()
+
+
+def test_send_requests_keeps_order(plugin, mocker):
+    in_flight = []
+    lock = threading.Lock()
+
+    def send(url, data, headers=None, method=None):
+        with lock:
+            in_flight.append(url)
+        # Answer the first request last
+        time.sleep(0.05 if url.endswith('/a') else 0.01)
+        response_data = mocker.Mock()
+        response_data.getvalue.return_value = url.encode('utf-8')
+        return mocker.Mock(status=200), response_data
+
+    plugin._connection.send.side_effect = send
+
+    plugin._get_limiter().window = 3.0
+    results = plugin.send_requests([('PUT', '/api/v2/cmdb/firewall/address/a', '{}'),
+                                    {'url': '/api/v2/cmdb/firewall/address/b', 'method': 'DELETE'},
+                                    ('PUT', '/api/v2/cmdb/firewall/address/c', '{}')], max_in_flight=3)
+
+    assert results == [(200, '/api/v2/cmdb/firewall/address/a'),
+                       (200, '/api/v2/cmdb/firewall/address/b'),
+                       (200, '/api/v2/cmdb/firewall/address/c')]
+    assert len(in_flight) == 3
+
+
+def test_adaptive_limiter_grows_and_backs_off():
+    limiter = AdaptiveLimiter(maximum=4, latency_target=2.0)
+
+    for dummy in range(10):
+        limiter.release(limiter.acquire(), failed=False)
+    assert limiter.state()['window'] == 4
+
+    first = limiter.acquire()
+    second = limiter.acquire()
+    limiter.release(first, failed=True)
+    limiter.release(second, failed=True)
+    assert limiter.state()['window'] == 2
+    assert limiter.state()['in_flight'] == 0
+    assert limiter.state()['error_rate'] > 0
+
+
+def test_send_request_feeds_limiter(plugin, mocker):
+    plugin._connection.send.return_value = (mocker.Mock(status=503), mocker.Mock(**{'getvalue.return_value': b''}))
+    plugin._options['retries'] = 0
+    plugin._get_limiter().window = 4.0
+
+    plugin.send_request(url='/api/v2/cmdb/firewall/address')
+
+    assert plugin.get_concurrency_window()['window'] == 2
+
+
+def answer(mocker, status, body=b'{}'):
+    return mocker.Mock(status=status), mocker.Mock(**{'getvalue.return_value': body})
+
+
+def test_send_request_retries_transient_errors(plugin, mocker):
+    sleep = mocker.patch('ansible.plugins.httpapi.fortios.time.sleep')
+    plugin._connection.send.side_effect = [Exception('connection reset'), answer(mocker, 503), answer(mocker, 200)]
+
+    assert plugin.send_request(url='/api/v2/cmdb/firewall/address/a', method='PUT', data='{}') == (200, '{}')
+    assert plugin._connection.send.call_count == 3
+    assert sleep.call_count == 2
+    assert sleep.call_args_list[1][0][0] <= 1.0
+
+
+def test_send_request_does_not_resend_processed_post(plugin, mocker):
+    mocker.patch('ansible.plugins.httpapi.fortios.time.sleep')
+    plugin._connection.send.side_effect = [answer(mocker, 502)]
+
+    assert plugin.send_request(url='/api/v2/cmdb/firewall/address', method='POST', data='{}')[0] == 502
+
+    plugin._connection.send.side_effect = [Exception('timed out')]
+    with pytest.raises(Exception):
+        plugin.send_request(url='/api/v2/cmdb/firewall/address', method='POST', data='{}')
+
+
+def test_send_request_logs_in_again_on_401(plugin, mocker):
+    plugin._connection.get_option.side_effect = lambda option: {'remote_user': 'admin', 'password': 'secret'}[option]
+
+    def login(username, password):
+        plugin._ccsrftoken = 'new-token'
+
+    mocker.patch.object(plugin, 'login', side_effect=login)
+    plugin._connection.send.side_effect = [answer(mocker, 401), answer(mocker, 200)]
+
+    assert plugin.send_request(url='/api/v2/cmdb/firewall/address')[0] == 200
+    plugin.login.assert_called_once_with('admin', 'secret')
+    assert plugin._connection.send.call_args[1]['headers']['x-csrftoken'] == 'new-token'
+
+
+def test_send_request_compression(plugin, mocker):
+    plugin._options['request_compression_min_size'] = 100
+    response = mocker.Mock(status=200)
+    response.info.return_value = {'Content-Encoding': 'gzip'}
+    response_data = mocker.Mock(**{'getvalue.return_value': gzip.compress(b'{"status": "success"}')})
+    plugin._connection.send.return_value = (response, response_data)
+    body = json.dumps({'name': 'logo', 'image-base64': 'A' * 200})
+
+    assert plugin.send_request(url='/api/v2/cmdb/system/replacemsg-image', method='POST', data=body) == \
+        (200, '{"status": "success"}')
+
+    args, kwargs = plugin._connection.send.call_args
+    assert gzip.decompress(args[1]) == body.encode('utf-8')
+    assert kwargs['headers']['Content-Encoding'] == 'gzip'
+    assert kwargs['headers']['Accept-Encoding'] == 'gzip'
+
+    plugin.send_request(url='/api/v2/cmdb/firewall/address/a', method='PUT', data='{}')
+    assert plugin._connection.send.call_args[0][1] == '{}'
+    assert 'Content-Encoding' not in plugin._connection.send.call_args[1]['headers']
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        body = STATUS_RESPONSE.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Drop the connection without telling the client, as a device timing it out would
+        self.close_connection = self.server.drop_connections
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StatusHandler)
+    server.connections = set()
+    server.drop_connections = False
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_keep_alive_pool_reuses_connection(server):
+    pool = KeepAlivePool('http://127.0.0.1:%d' % server.server_port, False, 5, 2)
+
+    for dummy in range(3):
+        response, body = pool.request('GET', '/api/v2/monitor/system/status', None, {})
+        assert response.status == 200
+    assert len(server.connections) == 1
+
+    # An idle connection closed by the device is replaced
+    server.drop_connections = True
+    pool.request('GET', '/api/v2/monitor/system/status', None, {})
+    response, body = pool.request('GET', '/api/v2/monitor/system/status', None, {})
+    assert json.loads(body.decode('utf-8'))['build'] == 163
+    assert len(server.connections) == 2
+
+
+def test_send_request_keep_alive(plugin, server):
+    plugin._options['keep_alive'] = True
+    plugin._connection._url = 'http://127.0.0.1:%d' % server.server_port
+    plugin._connection._auth = {'Cookie': 'APSCOOKIE_1="x"'}
+    plugin._connection.get_option.return_value = 5
+    plugin.update_auth = lambda response, response_text: None
+
+    assert plugin.get_system_status()['version'] == 'v6.0.2'
+    assert plugin.send_request(url='/api/v2/monitor/system/status')[0] == 200
+    assert len(server.connections) == 1